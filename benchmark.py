@@ -0,0 +1,275 @@
+import io
+import json
+import os
+import random
+import re
+import timeit
+import tracemalloc
+
+import numpy as np
+
+import interface
+import labeling
+import tiling
+
+
+def legacy_clean_latex(latex):
+    latex = latex.replace("(", "\\left(")
+    latex = latex.replace(")", "\\right)")
+    latex = latex.replace("[", "\\left[")
+    latex = latex.replace("]", "\\right]")
+
+    latex = latex.replace("\\{", "\\left\\{")
+    latex = latex.replace("\\}", "\\right\\}")
+
+    for function in interface.trig_functions:
+        latex = re.sub("([^c])" + function, "\\1\\\\" + function, latex)
+        latex = re.sub("^(.?.?)" + function, "\\1\\\\" + function, latex)
+
+    for function in interface.inverse_trig_functions:
+        latex = latex.replace(function, "\\" + function)
+
+    for function in interface.calculus:
+        latex = latex.replace(function, "\\" + function)
+
+    for operator in interface.desmos_operators:
+        latex = latex.replace(operator, "\\operatorname{" + operator + "}")
+
+    for expression in interface.latex_expressions:
+        latex = latex.replace(expression, "\\" + expression)
+
+    latex = latex.replace("->", "\\to")
+
+    latex = latex.replace("\\", "\\\\")
+
+    return latex
+
+
+def polygon_latex(n_points, seed=0):
+    rng = random.Random(seed)
+    points = [(rng.randrange(4096), rng.randrange(4096)) for _ in range(n_points)]
+    return "polygon(" + str(points) + ")"
+
+
+def time_call(function, argument, number):
+    return min(timeit.repeat(lambda: function(argument), number=number, repeat=5)) / number
+
+
+def bench_clean_latex():
+    inputs = [
+        ("short color", "rgb(12, 34, 56)", 10000),
+        ("short function", "y=sin(x)+max([1,2,3])", 10000),
+        ("polygon 1k points", polygon_latex(1000), 50),
+        ("polygon 50k points", polygon_latex(50000), 3),
+    ]
+
+    print("clean_latex")
+    for name, latex, number in inputs:
+        legacy = time_call(legacy_clean_latex, latex, number)
+        current = time_call(interface._normalize_latex, latex, number)
+        cached = time_call(interface.clean_latex, latex, number)
+        print("  {:<20} {:>8} bytes  legacy {:10.2f}us  single pass {:10.2f}us ({:5.1f}x)  memoized {:10.2f}us".format(
+            name, len(latex), legacy * 1e6, current * 1e6, legacy / current, cached * 1e6))
+
+
+def polygon_graph(n_expressions, n_points=20, seed=0):
+    rng = random.Random(seed)
+    graph = interface.Graph()
+    graph.reset_expressions()
+    folder = interface.Folder()
+    folder.set_title("Polygons")
+    for i in range(n_expressions):
+        expression = interface.Expression()
+        expression.set_latex(polygon_latex(n_points, seed + i))
+        expression.set_color_latex("rgb" + str((rng.randrange(256), rng.randrange(256), rng.randrange(256))))
+        expression.set_line_width(1)
+        expression.set_fill_opacity(1)
+        folder.add_expression(expression)
+    graph.append(folder)
+    return graph
+
+
+def bench_output_formats():
+    graph = polygon_graph(10000)
+
+    def write(output_format):
+        graph.generate_output(io.StringIO(), output_format=output_format)
+
+    print("Graph.generate_output, 10k polygons")
+    js = min(timeit.repeat(lambda: write("js"), number=1, repeat=3))
+    state = min(timeit.repeat(lambda: write("json"), number=1, repeat=3))
+    stdlib = min(timeit.repeat(lambda: json.dumps(graph.get_state(), separators=(",", ":")), number=1, repeat=3))
+    print("  js script {:8.1f}ms  json state {:8.1f}ms  json.dumps(get_state()) {:8.1f}ms".format(
+        js * 1e3, state * 1e3, stdlib * 1e3))
+
+
+def bench_polygon_encoding(n_polygons=2000, n_points=200):
+    rng = np.random.default_rng(0)
+    polygons = [rng.integers(0, 4096, (n_points, 2)) for _ in range(n_polygons)]
+
+    def legacy():
+        result = []
+        for points in polygons:
+            expression = interface.Expression()
+            expression.set_latex("polygon(" + str([tuple(n) for n in points.tolist()]) + ")")
+            result.append(expression.to_string())
+        return result
+
+    def compact():
+        result = []
+        for points in polygons:
+            expression = interface.Expression()
+            expression.set_polygon(points)
+            result.append(expression.to_string())
+        return result
+
+    print("Polygon latex, {} polygons of {} points".format(n_polygons, n_points))
+    for name, function in [("clean_latex", legacy), ("set_polygon", compact)]:
+        elapsed = min(timeit.repeat(function, number=1, repeat=3))
+        size = sum(len(n) for n in function())
+        print("  {:<16} {:8.1f}ms {:10} bytes".format(name, elapsed * 1e3, size))
+
+
+def measure(function):
+    tracemalloc.start()
+    start = timeit.default_timer()
+    result = function()
+    elapsed = timeit.default_timer() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, elapsed, size
+
+
+def bench_expression_batch(n_expressions=100000):
+    latex = [polygon_latex(4, i) for i in range(n_expressions)]
+    colors = ["rgb" + str((i % 256, 0, 0)) for i in range(n_expressions)]
+
+    def expressions():
+        result = []
+        for l, c in zip(latex, colors):
+            expression = interface.Expression()
+            expression.set_latex(l)
+            expression.set_color_latex(c)
+            expression.set_line_width(1)
+            expression.set_fill_opacity(1)
+            result.append(expression)
+        return result
+
+    def batch():
+        result = interface.ExpressionBatch()
+        result.extend(latex=latex, color_latex=colors, line_width=1, fill_opacity=1)
+        return result
+
+    print("Building {} expressions".format(n_expressions))
+    for name, function in [("Expression", expressions), ("ExpressionBatch", batch)]:
+        _, elapsed, size = measure(function)
+        print("  {:<16} {:8.1f}ms {:8.1f}MB".format(name, elapsed * 1e3, size / 2 ** 20))
+
+
+def bench_table(n_rows=200000):
+    rng = np.random.default_rng(0)
+    x = np.arange(n_rows)
+    y = rng.random(n_rows) * 100
+
+    def strings():
+        table = interface.Table()
+        table.add_columns({"x_1": [str(n) for n in x.tolist()], "y_1": [repr(n) for n in y.tolist()]})
+        return table
+
+    def arrays():
+        table = interface.Table()
+        table.add_columns({"x_1": x, "y_1": y})
+        return table
+
+    print("Table of {} rows".format(n_rows))
+    for name, function in [("string cells", strings), ("numpy columns", arrays)]:
+        table, elapsed, size = measure(function)
+        output = timeit.timeit(table.to_string, number=1)
+        print("  {:<16} build {:8.1f}ms {:8.1f}MB  serialize {:8.1f}ms".format(
+            name, elapsed * 1e3, size / 2 ** 20, output * 1e3))
+
+
+def synthetic_image(size, n_colors=8, block=4, seed=0):
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    palette = rng.integers(0, 256, (n_colors, 4), dtype=np.uint8)
+    palette[:, 3] = 255
+    cells = rng.integers(0, n_colors, (size // block + 1, size // block + 1))
+    pixels = palette[np.kron(cells, np.ones((block, block), dtype=int))[:size, :size]]
+    return Image.fromarray(pixels, "RGBA")
+
+
+def legacy_find_patches(im, diagonals=False):
+    width = im.width
+    height = im.height
+    neighbors_all = {(x, y) for x in range(-1, 2) for y in range(-1, 2) if x != 0 or y != 0}
+    neighbors_adjacent = {(x, y) for x in range(-1, 2) for y in range(-1, 2) if (x == 0) != (y == 0)}
+
+    def flood_fill(point, colors):
+        found_points = set()
+        queue = [point]
+        found_points.add(point)
+        while len(queue) > 0:
+            point = queue.pop(0)
+            neighbors = neighbors_all if diagonals else neighbors_adjacent
+            next_points = {(point[0] + n[0], point[1] + n[1]) for n in neighbors}
+            for p in next_points:
+                if p[0] < 0 or p[0] >= width:
+                    continue
+                if p[1] < 0 or p[1] >= height:
+                    continue
+                if im.getpixel(p) in colors:
+                    if p not in found_points:
+                        queue.append(p)
+                        found_points.add(p)
+        return found_points
+
+    unseen_points = {(x, y) for x in range(width) for y in range(height)}
+    patch_points = []
+    while len(unseen_points) > 0:
+        curr_point = unseen_points.pop()
+        curr_color = im.getpixel(curr_point)
+        same_color_points = flood_fill(curr_point, {curr_color})
+        patch_points.append((curr_color, same_color_points))
+        unseen_points.difference_update(same_color_points)
+    return patch_points
+
+
+def bench_labeling():
+    print("Patch labeling")
+    for size in [64, 128, 256, 1024, 2048]:
+        image = synthetic_image(size)
+        current = min(timeit.repeat(lambda: labeling.label_image(image), number=1, repeat=3))
+        name = "{0}x{0}".format(size)
+        if size <= 256:
+            legacy = min(timeit.repeat(lambda: legacy_find_patches(image), number=1, repeat=1))
+            print("  {:<10} flood fill {:9.1f}ms  labeling {:8.1f}ms ({:6.1f}x)".format(
+                name, legacy * 1e3, current * 1e3, legacy / current))
+        else:
+            print("  {:<10} flood fill {:>9}    labeling {:8.1f}ms".format(name, "-", current * 1e3))
+
+
+def bench_tiling(size=2048):
+    from concurrent.futures import ProcessPoolExecutor
+
+    pixels = labeling.image_to_array(synthetic_image(size, n_colors=16, block=3))
+    print("Labeling and tracing {0}x{0} by tiles".format(size))
+    tiles = 1
+    while tiles <= os.cpu_count():
+        with ProcessPoolExecutor(max_workers=tiles) as executor:
+            elapsed = min(timeit.repeat(lambda: tiling.label_and_trace(pixels, tiles=tiles, executor=executor),
+                                        number=1, repeat=2))
+        print("  {:>3} tiles {:8.1f}ms".format(tiles, elapsed * 1e3))
+        tiles *= 2
+
+
+if __name__ == "__main__":
+    bench_clean_latex()
+    bench_output_formats()
+    bench_polygon_encoding()
+    bench_expression_batch()
+    bench_table()
+    bench_labeling()
+    bench_tiling()
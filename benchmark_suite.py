@@ -0,0 +1,217 @@
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import sys
+import timeit
+
+import numpy as np
+
+import benchmark
+import contours
+import interface
+import labeling
+import polygon_image
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# A case is reported as slower when it takes this much longer than its baseline
+DEFAULT_THRESHOLD = 0.25
+
+# Shortest total time a case is repeated for, so fast cases are not all noise
+MIN_MEASURE_TIME = 0.2
+
+
+def nested_dict(depth, width, seed=0):
+    rng = random.Random(seed)
+    if depth == 0:
+        return {"latex": "\\operatorname{rgb}(" + str(rng.randrange(256)) + ",0,0)", "hidden": rng.random() < 0.5,
+                "size": rng.random()}
+    return {"id": str(rng.randrange(1 << 31)),
+            "columns": [nested_dict(depth - 1, width, seed * width + n) for n in range(width)]}
+
+
+def folder_graph(n_expressions, n_folders=10, n_points=20, seed=0):
+    rng = np.random.default_rng(seed)
+    graph = interface.Graph()
+    graph.reset_expressions()
+    folders = []
+    for n in range(n_folders):
+        folder = interface.Folder()
+        folder.set_title("Folder " + str(n))
+        folders.append(folder)
+        graph.append(folder)
+    for n in range(n_expressions):
+        expression = interface.Expression()
+        expression.set_polygon(rng.integers(0, 4096, (n_points, 2)))
+        expression.set_color_latex("rgb" + str(tuple(rng.integers(0, 256, 3).tolist())))
+        expression.set_line_width(1)
+        expression.set_fill_opacity(1)
+        folders[n % n_folders].add_expression(expression)
+    return graph
+
+
+def cold_output(graph):
+    # Every line is serialized again, as on a graph's first output
+    def run():
+        graph.clear_line_caches()
+        graph.generate_output(io.StringIO())
+    return run
+
+
+def edited_output(graph):
+    # One expression changes between runs, the rest come from the line caches
+    expression = graph.expressions[0].get_expressions()[0]
+    widths = iter(range(1 << 62))
+
+    def run():
+        expression.set_line_width(next(widths))
+        graph.generate_output(io.StringIO())
+    return run
+
+
+def image_cases(size, n_colors):
+    # Every stage of polygon_image runs on the previous stage's output, prepared
+    # once outside of the timed call
+    image = benchmark.synthetic_image(size, n_colors=n_colors, block=4, seed=size + n_colors)
+    pixels = labeling.image_to_array(image)
+    label_result = labeling.label_image(pixels)
+    traced = contours.trace_contours(label_result.labels, False)
+    colors = [tuple(n) for n in labeling.unpack_colors(label_result.colors).tolist()]
+    boundaries = [(color, patch[0]) for (color, patch) in zip(colors, traced)]
+    graph = polygon_image.image_to_graph(pixels)
+
+    name = "image {0}x{0} {1} colors ".format(size, n_colors)
+    return [
+        (name + "patch finding", lambda: labeling.label_image(pixels)),
+        (name + "boundary tracing", lambda: contours.trace_contours(label_result.labels, False)),
+        (name + "sorting", lambda: polygon_image.sort_boundaries(boundaries)),
+        (name + "emission", cold_output(graph)),
+        (name + "image_to_graph", lambda: polygon_image.image_to_graph(pixels)),
+    ]
+
+
+def get_cases(quick=False):
+    # Cases are built lazily, large inputs are only made when their group runs
+    yield [
+        ("clean_latex short", lambda: interface._normalize_latex("y=sin(x)+max([1,2,3])")),
+        ("clean_latex short memoized", lambda: interface.clean_latex("rgb(12, 34, 56)")),
+        ("clean_latex polygon 1k points", (lambda latex: lambda: interface.clean_latex(latex))(
+            benchmark.polygon_latex(1000))),
+        ("clean_latex polygon 50k points", (lambda latex: lambda: interface.clean_latex(latex))(
+            benchmark.polygon_latex(50000))),
+    ]
+
+    yield [
+        ("convert_to_string nested depth 3", (lambda d: lambda: interface.convert_to_string(d))(nested_dict(3, 8))),
+        ("convert_to_string nested depth 5", (lambda d: lambda: interface.convert_to_string(d))(nested_dict(5, 6))),
+    ]
+
+    for n_expressions in ([1000, 10000] if quick else [1000, 10000, 100000]):
+        graph = folder_graph(n_expressions)
+        yield [("generate_output {} expressions".format(n_expressions), cold_output(graph)),
+               ("generate_output {} expressions one edit".format(n_expressions), edited_output(graph))]
+
+    for size, n_colors in ([(128, 4), (256, 16)] if quick else [(128, 4), (256, 16), (512, 16), (1024, 64)]):
+        yield image_cases(size, n_colors)
+
+
+def measure_case(function, repeat=5):
+    # Fastest of repeat runs of as many calls as take MIN_MEASURE_TIME, cases
+    # slower than a second are only repeated twice
+    timer = timeit.Timer(function)
+    number = 1
+    elapsed = timer.timeit(number)
+    while elapsed < MIN_MEASURE_TIME:
+        number *= 10 if elapsed * 10 < MIN_MEASURE_TIME else 2
+        elapsed = timer.timeit(number)
+    if elapsed / number > 1:
+        repeat = min(repeat, 2)
+    return min([elapsed] + timer.repeat(repeat=repeat - 1, number=number)) / number
+
+
+def run_suite(quick=False, pattern=None, repeat=5, verbose=True):
+    results = {}
+    for group in get_cases(quick):
+        for name, function in group:
+            if pattern is not None and pattern not in name:
+                continue
+            results[name] = measure_case(function, repeat)
+            if verbose:
+                print("  {:<52} {:12.3f}ms".format(name, results[name] * 1e3), flush=True)
+    return results
+
+
+def compare_results(results, baseline, threshold=DEFAULT_THRESHOLD):
+    # Returns (name, current, baseline, ratio) for every case that got slower
+    slower = []
+    for name, seconds in results.items():
+        previous = baseline.get(name)
+        if previous and seconds > previous * (1 + threshold):
+            slower.append((name, seconds, previous, seconds / previous))
+    return slower
+
+
+def results_document(results):
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def save_results(path, results):
+    with open(path, "w") as f:
+        json.dump(results_document(results), f, indent=2, sort_keys=True)
+
+
+def parse_arguments(arguments=None):
+    parser = argparse.ArgumentParser(description="Time the interface and polygon_image stages")
+    parser.add_argument("-k", dest="pattern", help="only run cases whose name contains this text")
+    parser.add_argument("--quick", action="store_true", help="skip the largest inputs")
+    parser.add_argument("--repeat", type=int, default=5, help="timing repeats per case, the fastest is kept")
+    parser.add_argument("--json", dest="json_path", help="write the results to this file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="fraction a case may be slower than its baseline before it is flagged")
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None):
+    arguments = parse_arguments(arguments)
+    results = run_suite(arguments.quick, arguments.pattern, arguments.repeat)
+
+    if arguments.json_path is not None:
+        save_results(arguments.json_path, results)
+
+    if arguments.save_baseline:
+        baseline = load_results(arguments.baseline) if os.path.exists(arguments.baseline) else {}
+        baseline.update(results)
+        save_results(arguments.baseline, baseline)
+        print("Baseline saved to " + arguments.baseline)
+        return 0
+
+    if not os.path.exists(arguments.baseline):
+        print("No baseline at " + arguments.baseline + ", run with --save-baseline to create one")
+        return 0
+
+    slower = compare_results(results, load_results(arguments.baseline), arguments.threshold)
+    for name, seconds, previous, ratio in slower:
+        print("SLOWER {:<52} {:10.3f}ms vs {:10.3f}ms ({:.2f}x)".format(name, seconds * 1e3, previous * 1e3, ratio))
+    print("{} of {} cases slower than the baseline by more than {:.0%}".format(
+        len(slower), len(results), arguments.threshold))
+    return 1 if slower else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+import numpy as np
+
+
+# Directions in image coordinates (y down), index + 1 turns right and index - 1 turns left
+directions = np.array([(1, 0), (0, 1), (-1, 0), (0, -1)])
+
+# Offset from a vertex to the pixel on the right of an edge leaving it in each direction
+right_pixel = np.array([(0, 0), (-1, 0), (-1, -1), (0, -1)])
+
+
+def _boundary_edges(padded):
+    # Every pixel side between two different labels is a crack edge, directed so
+    # that its own pixel is on the right. Outer contours then run clockwise on
+    # screen and holes counterclockwise.
+    inner = padded[1:-1, 1:-1]
+    height, width = inner.shape
+    ys, xs = np.mgrid[0:height, 0:width]
+
+    starts = []
+    edge_directions = []
+    for direction, (nx, ny), (sx, sy) in [
+        (0, (0, -1), (0, 0)),  # top side, heading east
+        (1, (1, 0), (1, 0)),  # right side, heading south
+        (2, (0, 1), (1, 1)),  # bottom side, heading west
+        (3, (-1, 0), (0, 1)),  # left side, heading north
+    ]:
+        neighbor = padded[1 + ny:1 + ny + height, 1 + nx:1 + nx + width]
+        boundary = inner != neighbor
+        starts.append(np.stack([xs[boundary] + sx, ys[boundary] + sy], axis=1))
+        edge_directions.append(np.full(np.count_nonzero(boundary), direction))
+
+    return np.concatenate(starts), np.concatenate(edge_directions)
+
+
+def _jump(values, jump, limits, rounds, combine):
+    # Pointer jumping over the edges still in play. An edge drops out once the
+    # jump window covers its whole label, which no cycle can be longer than, so
+    # edges of small patches finish after a few rounds. The cost is
+    # O(E log L) for E edges and L edges in the largest label, not linear.
+    active = None
+    for k in range(rounds):
+        if active is None:
+            values = combine(values, values[jump])
+            jump = jump[jump]
+            if (limits <= 2 << k).any():
+                active = np.flatnonzero(limits > 2 << k)
+        else:
+            targets = jump[active]
+            values[active] = combine(values[active], values[targets])
+            jump[active] = jump[targets]
+            active = active[limits[active] > 2 << k]
+    return values
+
+
+def _cycles(successors, limits):
+    # Every edge learns the smallest edge index on its cycle, and how many
+    # steps remain until the cycle wraps around to that edge.
+    n = len(successors)
+    rounds = max(1, int(limits.max(initial=1)).bit_length())
+    cycle_ids = _jump(np.arange(n), successors, limits, rounds, np.minimum)
+
+    last = cycle_ids[successors] == successors
+    remaining = (~last).astype(np.int64)
+    jump = np.where(last, np.arange(n), successors)
+    remaining = _jump(remaining, jump, limits, rounds, np.add)
+
+    return cycle_ids, remaining
+
+
+def trace_label_contours(labels, diagonals=False, selected=None):
+    # Returns a dict from label to its outer contour followed by every hole,
+    # each as an (N, 2) array of pixel corner coordinates (x, y). Only labels in
+    # selected are traced when it is given.
+    labels = np.asarray(labels)
+    height, width = labels.shape
+    padded = np.full((height + 2, width + 2), -1, dtype=np.int64)
+    padded[1:-1, 1:-1] = labels
+
+    starts, edge_directions = _boundary_edges(padded)
+    edge_labels = padded[starts[:, 1] + right_pixel[edge_directions, 1] + 1,
+                         starts[:, 0] + right_pixel[edge_directions, 0] + 1]
+    if selected is not None:
+        # Successors always share the edge's label, so other labels' edges can be dropped up front
+        keep = np.isin(edge_labels, selected)
+        starts = starts[keep]
+        edge_directions = edge_directions[keep]
+        edge_labels = edge_labels[keep]
+
+    edge_index = np.full((height + 1, width + 1, 4), -1, dtype=np.int64)
+    edge_index[starts[:, 1], starts[:, 0], edge_directions] = np.arange(len(starts))
+
+    # Choose each edge's successor from the two pixels ahead of its end vertex
+    ends = starts + directions[edge_directions]
+    left_directions = (edge_directions - 1) % 4
+    right_labels = padded[ends[:, 1] + right_pixel[edge_directions, 1] + 1,
+                          ends[:, 0] + right_pixel[edge_directions, 0] + 1]
+    right_inside = right_labels == edge_labels
+    left_inside = padded[ends[:, 1] + right_pixel[left_directions, 1] + 1,
+                         ends[:, 0] + right_pixel[left_directions, 0] + 1] == edge_labels
+
+    # A diagonal touch is joined along the top left to bottom right diagonal
+    # (edges heading south or north), and along the other one unless the two
+    # remaining pixels share a label, which makes it a crossing the first
+    # diagonal won. labeling._run_edges resolves crossings the same way.
+    joined = np.zeros(len(starts), dtype=bool)
+    if diagonals:
+        behind_directions = (edge_directions + 2) % 4
+        behind_labels = padded[ends[:, 1] + right_pixel[behind_directions, 1] + 1,
+                               ends[:, 0] + right_pixel[behind_directions, 0] + 1]
+        joined = (edge_directions % 2 == 1) | (right_labels != behind_labels)
+
+    turn_left = left_inside & (right_inside | joined)
+    go_straight = right_inside & ~left_inside
+    next_directions = np.where(turn_left, left_directions, np.where(go_straight, edge_directions, (edge_directions + 1) % 4))
+    successors = edge_index[ends[:, 1], ends[:, 0], next_directions]
+
+    limits = np.bincount(edge_labels)[edge_labels]
+    cycle_ids, remaining = _cycles(successors, limits)
+
+    # Lay the cycles out one after another, each starting at its smallest edge
+    sizes = np.bincount(cycle_ids, minlength=len(starts))
+    offsets = np.cumsum(sizes) - sizes
+    order = np.empty(len(starts), dtype=np.int64)
+    order[offsets[cycle_ids] + sizes[cycle_ids] - 1 - remaining] = np.arange(len(starts))
+    vertices = starts[order]
+
+    heads = np.flatnonzero(sizes)
+    bounds = np.append(offsets[heads], len(starts)).tolist()
+
+    # Signed shoelace area per cycle, positive for outer contours
+    cross = starts[:, 0] * ends[:, 1] - ends[:, 0] * starts[:, 1]
+    areas = np.bincount(cycle_ids, weights=cross, minlength=len(starts))[heads]
+
+    contours = {}
+    holes = {}
+    for i, (label, outer) in enumerate(zip(edge_labels[heads].tolist(), (areas > 0).tolist())):
+        contour = vertices[bounds[i]:bounds[i + 1]]
+        if outer:
+            contours.setdefault(label, []).append(contour)
+        else:
+            holes.setdefault(label, []).append(contour)
+
+    for label, label_holes in holes.items():
+        contours[label].extend(label_holes)
+    return contours
+
+
+def trace_contours(labels, diagonals=False):
+    # Returns one list per label, holding the outer contour first and then every
+    # hole, each as an (N, 2) array of pixel corner coordinates (x, y).
+    labels = np.asarray(labels)
+    traced = trace_label_contours(labels, diagonals)
+    return [traced[n] for n in range(labels.max() + 1 if labels.size else 0)]
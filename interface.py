@@ -1,10 +1,49 @@
+import codecs
+import collections
+import functools
+import hashlib
+import io
+import json
+import os
 import re
 import random
 
+import numpy as np
+
+import profiling
+
 initial_template = """let state = Calc.getState();
 let expressions = state.expressions.list;"""
 
 end_template = "Calc.setState(state);"
+
+OUTPUT_BUFFER_SIZE = 1 << 16
+
+# Desmos lists hold at most this many elements
+MAX_LIST_LENGTH = 10000
+
+MANIFEST_VERSION = 1
+
+# Variable names given to interned style values, by kind of value. Graphs that
+# intern their styles should not define these names themselves.
+style_variables = {
+    "color": "c",
+    "number": "s",
+}
+
+style_kinds = {prefix: kind for (kind, prefix) in style_variables.items()}
+
+# A definition made by Graph.intern_styles, such as c_{3}=...
+_style_definition = re.compile("(" + "|".join(map(re.escape, style_kinds)) + r")_\{(\d+)\}=")
+
+STYLES_TITLE = "Styles"
+
+InternStats = collections.namedtuple("InternStats", ["variables", "bytes_before", "bytes_after"])
+
+# Serialized lines reused from their cache (hits) or built again (misses), and
+# the bytes built again, since the last reset_cache_stats
+cache_stats = collections.Counter()
+
 trig_functions = [
     "sin",
     "cos",
@@ -94,6 +133,46 @@ latex_expressions = [
     "pi",
 ]
 
+# Values the Desmos.* constants evaluate to in a serialized calculator state
+desmos_enums = {
+    "Desmos.Styles.SOLID": "solid",
+    "Desmos.Styles.DASHED": "dashed",
+    "Desmos.Styles.DOTTED": "dotted",
+    "Desmos.Styles.POINT": "point",
+    "Desmos.Styles.OPEN": "open",
+    "Desmos.Styles.CROSS": "cross",
+    "Desmos.DragModes.X": "X",
+    "Desmos.DragModes.Y": "Y",
+    "Desmos.DragModes.XY": "XY",
+    "Desmos.DragModes.NONE": "NONE",
+    "Desmos.LabelOrientations.ABOVE": "above",
+    "Desmos.LabelOrientations.BELOW": "below",
+    "Desmos.LabelOrientations.LEFT": "left",
+    "Desmos.LabelOrientations.RIGHT": "right",
+    "Desmos.LabelOrientations.DEFAULT": "default",
+}
+
+STATE_VERSION = 9
+
+
+def escape_js_string(s):
+    s = s.replace("\\", "\\\\")
+    if "'" in s:
+        s = s.replace("'", "\\'")
+    if "\n" in s:
+        s = s.replace("\n", "\\n")
+    return s
+
+
+def convert_to_state(d):
+    if isinstance(d, str):
+        return desmos_enums.get(d, d)
+    if isinstance(d, dict):
+        return {k: convert_to_state(v) for (k, v) in d.items() if v is not None}
+    if isinstance(d, list):
+        return [convert_to_state(n) for n in d]
+    return d
+
 
 def convert_to_string(d):
     if isinstance(d, bool):
@@ -102,7 +181,7 @@ def convert_to_string(d):
         if d.startswith("Desmos."):
             return d
         else:
-            return "'" + d + "'"
+            return "'" + escape_js_string(d) + "'"
     if isinstance(d, int) or isinstance(d, float):
         return str(d)
     if isinstance(d, dict):
@@ -120,36 +199,347 @@ def convert_to_string(d):
     print("Unknown type: " + type(d))
 
 
-def clean_latex(latex):
-    latex = latex.replace("(", "\\left(")
-    latex = latex.replace(")", "\\right)")
-    latex = latex.replace("[", "\\left[")
-    latex = latex.replace("]", "\\right]")
+def _build_latex_replacements():
+    replacements = {
+        "(": "\\left(",
+        ")": "\\right)",
+        "[": "\\left[",
+        "]": "\\right]",
+        "\\{": "\\left\\{",
+        "\\}": "\\right\\}",
+        "->": "\\to ",
+    }
+    for name in trig_functions + inverse_trig_functions + calculus + latex_expressions:
+        replacements[name] = "\\" + name
+    for operator in desmos_operators:
+        replacements[operator] = "\\operatorname{" + operator + "}"
 
-    latex = latex.replace("\\{", "\\left\\{")
-    latex = latex.replace("\\}", "\\right\\}")
+    return replacements
 
-    for function in trig_functions:
-        latex = re.sub("([^c])" + function, "\\1\\\\" + function, latex)
-        latex = re.sub("^(.?.?)" + function, "\\1\\\\" + function, latex)
 
-    for function in inverse_trig_functions:
-        latex = latex.replace(function, "\\" + function)
+def _build_latex_tokenizer():
+    # Functions that may directly follow a variable when called, as in xsin(x).
+    # Names never called with parentheses (int, sum, pi) stay whole words, so
+    # point( is not split.
+    called = sorted(trig_functions + inverse_trig_functions + ["exp", "ln", "log"], key=len, reverse=True)
+    called = "(?:" + "|".join(called) + ")"
+    return re.compile(
+        # Cheap first-character filter so the scan skips digits, commas and spaces quickly
+        r"(?=[()\[\]\\A-Za-z-])("
+        r"[()\[\]]"
+        # Already escaped LaTeX is kept intact
+        r"|\\(?:operatorname\{[^{}]*\}|(?:left|right)(?:\\[{}|]|[()\[\].|])|[{}])?"
+        # Whole words, names are looked up once the word is matched. A word
+        # ending in a called function is split in front of it, unless the whole
+        # word is one.
+        r"|(?<![A-Za-z\\])(?=" + called + r"\()[A-Za-z]+"
+        r"|(?<![A-Za-z\\])[A-Za-z]+?(?=" + called + r"\()"
+        r"|(?<=[A-Za-z])" + called + r"(?=\()"
+        r"|(?<![A-Za-z\\])[A-Za-z]+"
+        r"|->"
+        r")"
+    )
 
-    for function in calculus:
-        latex = latex.replace(function, "\\" + function)
 
-    for operator in desmos_operators:
-        latex = latex.replace(operator, "\\operatorname{" + operator + "}")
+_latex_replacements = _build_latex_replacements()
+_latex_tokenizer = _build_latex_tokenizer()
+
+# Only short strings (colors, widths, opacities) are memoized, long polygon
+# latex would pin megabytes in the cache for no benefit.
+_LATEX_MEMO_MAX_LENGTH = 256
+
+
+def _normalize_latex(latex):
+    parts = _latex_tokenizer.split(latex)
+    replacements = _latex_replacements
+    parts[1::2] = [replacements.get(t, t) for t in parts[1::2]]
+    return "".join(parts)
+
+
+_normalize_latex_cached = functools.lru_cache(maxsize=4096)(_normalize_latex)
+
+
+def clean_latex(latex):
+    if len(latex) <= _LATEX_MEMO_MAX_LENGTH:
+        return _normalize_latex_cached(latex)
+    return _normalize_latex(latex)
 
-    for expression in latex_expressions:
-        latex = latex.replace(expression, "\\" + expression)
 
-    latex = latex.replace("->", "\\to")
+def _format_scientific(value):
+    if value == "nan":
+        return ""
+    if value.endswith("inf"):
+        return value[:-3] + "\\infty"
+    mantissa, exponent = value.split("e")
+    return mantissa + "\\times10^{" + str(int(exponent)) + "}"
+
+
+def format_numbers(values):
+    # Shortest round-tripping decimal of every number as Desmos latex, without
+    # going through clean_latex. NaN becomes an empty cell.
+    values = np.asarray(values)
+    if values.dtype.kind == "b":
+        values = values.astype(np.int64)
+    if values.dtype.kind in "iu":
+        return list(map(str, values.tolist()))
+
+    if values.dtype != np.float64:
+        # repr of the widened value would not be the shortest one for float32
+        strings = values.astype(str).tolist()
+    else:
+        strings = list(map(repr, values.tolist()))
+
+    finite = np.isfinite(values)
+    magnitudes = np.abs(np.where(finite, values, 0))
+    integral = finite & (magnitudes < 1e16) & (values == np.rint(values))
+    for n in np.flatnonzero(integral).tolist():
+        strings[n] = strings[n][:-2]
+    # Python and NumPy both switch to exponents outside of 1e-4 to 1e16
+    special = ~finite | (magnitudes >= 1e16) | ((magnitudes < 1e-4) & (magnitudes > 0))
+    for n in np.flatnonzero(special).tolist():
+        strings[n] = _format_scientific(strings[n])
+    return strings
+
+
+def point_list_latex(points):
+    # (N, 2) coordinates as "(x,y),(x,y)" with plain parens, which Desmos
+    # accepts as is, so the latex needs no cleaning
+    points = np.asarray(points)
+    if points.dtype.kind in "biu":
+        coordinates = list(map(str, points.ravel().tolist()))
+    else:
+        coordinates = format_numbers(points.ravel())
+    return "(" + "),(".join(map(",".join, zip(coordinates[0::2], coordinates[1::2]))) + ")"
 
-    latex = latex.replace("\\", "\\\\")
 
-    return latex
+def polygon_latex(points):
+    return "\\operatorname{polygon}(" + point_list_latex(points) + ")"
+
+
+def polygons_latex(polygons):
+    # A list of polygons drawn by one expression
+    return "[" + ",".join(map(polygon_latex, polygons)) + "]"
+
+
+def _number_list_latex(values):
+    values = np.asarray(values)
+    if values.dtype.kind in "biu":
+        return "[" + ",".join(map(str, values.tolist())) + "]"
+    return "[" + ",".join(format_numbers(values)) + "]"
+
+
+def rectangles_latex(bounds):
+    # (N, 4) rows of x0, y0, x1, y1 as one polygon over lists of corner
+    # coordinates, which Desmos draws as N rectangles
+    bounds = np.asarray(bounds)
+    if len(bounds) == 1:
+        x0, y0, x1, y1 = bounds[0]
+        return polygon_latex(np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]]))
+    x0, y0, x1, y1 = (_number_list_latex(bounds[:, n]) for n in range(4))
+    return ("\\operatorname{polygon}((" + x0 + "," + y0 + "),(" + x1 + "," + y0 + "),("
+            + x1 + "," + y1 + "),(" + x0 + "," + y1 + "))")
+
+
+_json_encoder = json.JSONEncoder(separators=(",", ":"))
+
+
+def _state_index(expression_id):
+    # Script text for the position of an id in the state's expression list, -1
+    # when it is missing or None
+    if expression_id is None:
+        return "-1"
+    return "expressions.findIndex(n => n.id === " + convert_to_string(expression_id) + ")"
+
+
+def _output_line_size(line):
+    # Bytes a line adds to the script, with its newline
+    return len("expressions.push(" + line.to_string() + ");") + 1
+
+
+def _is_binary_stream(stream):
+    if isinstance(stream, io.TextIOBase):
+        return False
+    if isinstance(stream, (io.RawIOBase, io.BufferedIOBase)):
+        return True
+    return "b" in getattr(stream, "mode", "")
+
+
+def _write_lines(stream, lines, buffer_size=OUTPUT_BUFFER_SIZE):
+    # Lines are gathered into chunks of roughly buffer_size characters so a
+    # graph of any size is written with a bounded amount of memory.
+    binary = _is_binary_stream(stream)
+    chunk = []
+    chunk_size = 0
+    separator = ""
+    for line in lines:
+        chunk.append(line)
+        chunk_size += len(line) + 1
+        if chunk_size >= buffer_size:
+            data = separator + "\n".join(chunk)
+            stream.write(data.encode("utf-8") if binary else data)
+            profiling.count("bytes emitted", len(data))
+            chunk = []
+            chunk_size = 0
+            separator = "\n"
+
+    if chunk:
+        data = separator + "\n".join(chunk)
+        stream.write(data.encode("utf-8") if binary else data)
+        profiling.count("bytes emitted", len(data))
+
+
+def get_cache_stats():
+    lookups = cache_stats["hits"] + cache_stats["misses"]
+    return {
+        "hits": cache_stats["hits"],
+        "misses": cache_stats["misses"],
+        "hit_rate": cache_stats["hits"] / lookups if lookups else None,
+        "serialized_bytes": cache_stats["bytes"],
+    }
+
+
+def reset_cache_stats():
+    cache_stats.clear()
+
+
+_json_decoder = json.JSONDecoder()
+
+# Serialized enum values back to the Desmos.* constants the setters store
+desmos_constants = {v: k for (k, v) in desmos_enums.items()}
+
+_enum_fields = ["lineStyle", "pointStyle", "dragMode", "labelOrientation"]
+
+
+def _restore_enums(fields):
+    for key in _enum_fields:
+        if key in fields:
+            fields[key] = desmos_constants.get(fields[key], fields[key])
+    return fields
+
+
+class _StateReader:
+    # Pulls JSON values one at a time from a text stream, keeping only the
+    # unparsed rest of the current chunk in memory
+    def __init__(self, stream, chunk_size=OUTPUT_BUFFER_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.position = 0
+        self.done = False
+        # Binary streams may split a character across chunks
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+
+    def __fill(self, size):
+        data = self.stream.read(size)
+        if not data:
+            self.done = True
+        if isinstance(data, bytes):
+            data = self.decoder.decode(data, final=self.done)
+        self.buffer = self.buffer[self.position:] + data
+        self.position = 0
+
+    def peek(self):
+        # Next non whitespace character, "" at the end of the stream
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in " \t\r\n":
+                self.position += 1
+            if self.position < len(self.buffer) or self.done:
+                return self.buffer[self.position:self.position + 1]
+            self.__fill(self.chunk_size)
+
+    def expect(self, character):
+        if self.peek() != character:
+            raise ValueError("Expected " + repr(character) + " in Desmos state, got " + repr(self.peek()))
+        self.position += 1
+
+    def value(self, raw=False):
+        # With raw, returns the value and the JSON text it was read from. A value
+        # is only accepted once something follows it, so a number or literal cut
+        # at the chunk end is never decoded early. Failed attempts read twice as
+        # much each time, so large values are decoded a bounded number of times.
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = _json_decoder.raw_decode(self.buffer, self.position)
+                if end < len(self.buffer) or self.done:
+                    start = self.position
+                    self.position = end
+                    return (value, self.buffer[start:end]) if raw else value
+            except json.JSONDecodeError:
+                if self.done:
+                    raise
+            self.__fill(size)
+            size *= 2
+
+    def items(self):
+        # Yields the keys of the object at the cursor, the caller consumes each value
+        self.expect("{")
+        if self.peek() == "}":
+            self.position += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self.position += 1
+                continue
+            self.expect("}")
+            return
+
+    def elements(self, raw=False):
+        self.expect("[")
+        if self.peek() == "]":
+            self.position += 1
+            return
+        while True:
+            yield self.value(raw)
+            if self.peek() == ",":
+                self.position += 1
+                continue
+            self.expect("]")
+            return
+
+
+def iter_state_expressions(source, chunk_size: int = OUTPUT_BUFFER_SIZE, raw: bool = False):
+    # Yields the entries of expressions.list of a Desmos state given as a dict,
+    # JSON text, a path or a file object, one at a time. With raw, every entry
+    # comes with its JSON text.
+    if isinstance(source, dict):
+        for state in source.get("expressions", {}).get("list", []):
+            yield (state, _json_encoder.encode(state)) if raw else state
+        return
+    if isinstance(source, str) and source.lstrip()[:1] == "{":
+        source = io.StringIO(source)
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, encoding="utf-8") as f:
+            yield from iter_state_expressions(f, chunk_size, raw)
+        return
+
+    reader = _StateReader(source, chunk_size)
+    for key in reader.items():
+        if key != "expressions":
+            reader.value()
+            continue
+        for expressions_key in reader.items():
+            if expressions_key == "list":
+                yield from reader.elements(raw)
+            else:
+                reader.value()
+
+
+def line_from_state(state):
+    line_type = state.get("type", "expression")
+    if line_type == "expression":
+        return Expression.from_state(state)
+    if line_type == "folder":
+        return Folder.from_state(state)
+    if line_type == "table":
+        return Table.from_state(state)
+    if line_type == "text":
+        return Text.from_state(state)
+    return StateLine(state)
 
 
 class Graph:
@@ -157,13 +547,257 @@ class Graph:
         self.expressions = []
         self.string_lines = ["let state = Calc.getState();"]
 
-    def generate_output(self, filename):
-        f = open(filename, "w")
-        for expression in self.expressions:
-            self.__add_expression_string(expression)
+    @classmethod
+    def from_state(cls, source, lazy: bool = False, chunk_size: int = OUTPUT_BUFFER_SIZE):
+        # Rebuilds a graph from a Desmos state (dict, JSON text, path or file),
+        # parsing its expression list one entry at a time. Expressions with a
+        # folderId are added to that folder. With lazy, folder contents are
+        # kept as compact JSON until the folder's expressions are asked for.
+        graph = cls()
+        graph.reset_expressions()
+        folders = {}
+        for state, state_json in iter_state_expressions(source, chunk_size, raw=True):
+            folder = folders.get(state.get("folderId"))
+            if folder is not None and state.get("type", "expression") != "folder":
+                if lazy:
+                    folder.add_pending(state_json)
+                else:
+                    folder.add_expression(line_from_state(state))
+                continue
+            line = line_from_state(state)
+            if isinstance(line, Folder):
+                folders[state.get("id")] = line
+            graph.append(line)
+        return graph
+
+    def generate_output(self, output, buffer_size: int = OUTPUT_BUFFER_SIZE, output_format: str = "js",
+                        max_bytes: int = None, max_expressions: int = None):
+        if max_bytes is not None or max_expressions is not None:
+            if output_format != "js":
+                raise ValueError("Only js output can be split into shards")
+            return self.generate_shards(output, max_bytes, max_expressions)
+
+        if output_format == "json":
+            lines = self.iter_state()
+        else:
+            lines = self.iter_output()
+
+        with profiling.stage("write"):
+            if isinstance(output, (str, os.PathLike)):
+                with open(output, "w") as f:
+                    _write_lines(f, lines, buffer_size)
+            else:
+                _write_lines(output, lines, buffer_size)
+
+    def iter_output(self):
+        yield from self.string_lines
+        for expression in self.__iter_expressions(self.expressions):
+            for string in expression.iter_strings():
+                yield "expressions.push(" + string + ");"
+        yield end_template
+
+    def iter_shards(self, max_bytes: int = None, max_expressions: int = None):
+        # Yields the lines of one script per shard. The first shard starts like
+        # the full script, the others append to the state the previous ones set.
+        # A folder is kept in the shard of its first expression, and an
+        # expression larger than max_bytes gets a shard of its own.
+        header = list(self.string_lines)
+        footer_size = len(end_template.encode("utf-8"))
+        shard = header
+        size = sum(len(n.encode("utf-8")) + 1 for n in shard)
+        count = 0
+        pending = []
+        for expression in self.__iter_expressions(self.expressions):
+            for string in expression.iter_strings():
+                line = "expressions.push(" + string + ");"
+                if isinstance(expression, Folder):
+                    pending.append(line)
+                    continue
+                lines = pending + [line]
+                pending = []
+                added = sum(len(n.encode("utf-8")) + 1 for n in lines)
+                if count and ((max_expressions is not None and count + len(lines) > max_expressions)
+                              or (max_bytes is not None and size + added + footer_size > max_bytes)):
+                    yield shard + [end_template]
+                    shard = initial_template.split("\n")
+                    size = sum(len(n.encode("utf-8")) + 1 for n in shard)
+                    count = 0
+                shard.extend(lines)
+                size += added
+                count += len(lines)
+        shard.extend(pending)
+        yield shard + [end_template]
+
+    def generate_shards(self, output, max_bytes: int = None, max_expressions: int = None):
+        # Writes output.1.txt, output.2.txt, ... to be run in order, and a
+        # manifest of their sizes to output.manifest.json
+        stem, extension = os.path.splitext(os.fspath(output))
+        shards = []
+        for number, lines in enumerate(self.iter_shards(max_bytes, max_expressions), 1):
+            path = stem + "." + str(number) + (extension or ".txt")
+            data = "\n".join(lines).encode("utf-8")
+            with profiling.stage("write"), open(path, "wb") as f:
+                f.write(data)
+            profiling.count("bytes emitted", len(data))
+            shards.append({
+                "file": os.path.basename(path),
+                "bytes": len(data),
+                "expressions": sum(n.startswith("expressions.push(") for n in lines),
+            })
+
+        manifest = {
+            "shards": shards,
+            "bytes": sum(n["bytes"] for n in shards),
+            "expressions": sum(n["expressions"] for n in shards),
+        }
+        with open(stem + ".manifest.json", "w") as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+    def iter_state(self):
+        # The state document is emitted one expression per line so it can be
+        # streamed like the script output, each line is encoded by the C json encoder.
+        yield '{"version":' + str(STATE_VERSION) + ',"expressions":{"list":['
+        separator = ""
+        for expression in self.__iter_expressions(self.expressions):
+            for state in expression.iter_states():
+                yield separator + _json_encoder.encode(state)
+                separator = ","
+        yield "]}}"
+
+    def get_state(self):
+        return {
+            "version": STATE_VERSION,
+            "expressions": {"list": [s for n in self.__iter_expressions(self.expressions) for s in n.iter_states()]},
+        }
+
+    def get_manifest(self):
+        # Expression ids in output order with a digest of each serialized expression
+        manifest = [[expression_id, digest] for (expression_id, _, digest, _) in self.__iter_digests()]
+        return {"version": MANIFEST_VERSION, "expressions": manifest}
+
+    def __iter_digests(self):
+        for expression in self.__iter_expressions(self.expressions):
+            for expression_id, string in expression.iter_items():
+                if expression_id is None:
+                    raise ValueError("Every expression needs an id to be diffed, missing on: " + string[:80])
+                yield expression_id, string, hashlib.sha1(string.encode("utf-8")).hexdigest(), expression
+
+    def save_manifest(self, output):
+        if isinstance(output, (str, os.PathLike)):
+            with open(output, "w") as f:
+                json.dump(self.get_manifest(), f)
+        else:
+            json.dump(self.get_manifest(), output)
 
-        self.__push_to_calc()
-        f.write("\n".join(self.string_lines))
+    def generate_update(self, output, previous, buffer_size: int = OUTPUT_BUFFER_SIZE):
+        lines = self.iter_update(previous)
+        if isinstance(output, (str, os.PathLike)):
+            with open(output, "w") as f:
+                _write_lines(f, lines, buffer_size)
+        else:
+            _write_lines(output, lines, buffer_size)
+
+    def iter_update(self, previous):
+        # previous is another Graph, a manifest or a path to a saved manifest.
+        # Changed expressions and tables are set in place. Calc.setExpression
+        # takes nothing else and appends what it adds, so changed folders and
+        # texts and every added line are patched into the state instead, added
+        # lines right after the line before them to keep the drawing order and
+        # folder contents together. Lines that only moved keep their old place.
+        if isinstance(previous, Graph):
+            previous = previous.get_manifest()
+        elif isinstance(previous, (str, os.PathLike)):
+            with open(previous) as f:
+                previous = json.load(f)
+        previous_hashes = dict(previous["expressions"])
+
+        current_ids = set()
+        patches = []
+        previous_id = None
+        for expression_id, string, digest, line in self.__iter_digests():
+            current_ids.add(expression_id)
+            previous_digest = previous_hashes.get(expression_id)
+            if previous_digest is None:
+                patches.append("expressions.splice(" + _state_index(previous_id) + " + 1, 0, " + string + ");")
+            elif previous_digest != digest:
+                if isinstance(line, (Expression, ExpressionBatch, Table)):
+                    yield "Calc.setExpression(" + string + ");"
+                else:
+                    patches.append("expressions[" + _state_index(expression_id) + "] = " + string + ";")
+            previous_id = expression_id
+
+        for expression_id, _ in previous["expressions"]:
+            if expression_id not in current_ids:
+                yield "Calc.removeExpression(" + convert_to_string({"id": expression_id}) + ");"
+
+        if patches:
+            yield initial_template
+            yield from patches
+            yield end_template
+
+    def intern_styles(self, min_count: int = 2):
+        # Style values repeated at least min_count times are replaced by variables
+        # defined in a hidden folder at the top of the graph, when that is shorter
+        # counting the lines of the definitions and of the folder. Another call
+        # adds to the folder and numbers on from the variables already defined.
+        counts = collections.Counter()
+        numbers = collections.Counter()
+        for expression in self.__iter_expressions(self.expressions):
+            for kind, value in expression.iter_styles():
+                if value is not None:
+                    counts[(kind, value)] += 1
+            if not isinstance(expression, Expression):
+                continue
+            match = _style_definition.match(expression._get_fields()["latex"] or "")
+            if match:
+                kind = style_kinds[match.group(1)]
+                numbers[kind] = max(numbers[kind], int(match.group(2)))
+
+        bytes_before = self.get_output_size()
+        folder = self.expressions[0] if self.expressions else None
+        if not (isinstance(folder, Folder) and folder._get_fields()["title"] == STYLES_TITLE):
+            folder = Folder()
+            folder.set_title(STYLES_TITLE)
+            folder.set_hidden(True)
+            folder.set_collapsed(True)
+            saved = -_output_line_size(folder)
+        else:
+            saved = 0
+
+        variables = {}
+        definitions = []
+        for (kind, value), count in counts.most_common():
+            if count < min_count:
+                break
+            name = style_variables[kind] + "_{" + str(numbers[kind] + 1) + "}"
+            definition = Expression()
+            definition.set_latex(name + "=" + value)
+            definition.add_to_folder(folder.get_id())
+            value_saved = count * (len(escape_js_string(value)) - len(name)) - _output_line_size(definition)
+            if value_saved <= 0:
+                continue
+            numbers[kind] += 1
+            variables[(kind, value)] = name
+            definitions.append(definition)
+            saved += value_saved
+
+        if saved <= 0:
+            return InternStats(0, bytes_before, bytes_before)
+        for expression in self.__iter_expressions(self.expressions):
+            expression.replace_styles(variables)
+        folder.add_expressions(definitions)
+        if folder is not self.expressions[0]:
+            self.expressions.insert(0, folder)
+        return InternStats(len(variables), bytes_before, self.get_output_size())
+
+    def get_output_size(self):
+        return sum(len(n) + 1 for n in self.iter_output()) - 1
+
+    def clear_line_caches(self):
+        # The next output serializes every line again
+        for expression in self.__iter_expressions(self.expressions):
+            expression._invalidate()
 
     def get_current_expressions(self):
         self.string_lines.append("let expressions = state.expressions.list;")
@@ -172,35 +806,141 @@ class Graph:
         self.string_lines.append("state.expressions.list = []")
         self.get_current_expressions()
 
-    def __add_expression_string(self, expression):
-        self.string_lines.append("expressions.push(" + expression.to_string() + ");")
-        if isinstance(expression, Folder):
-            for nested_expression in expression.get_expressions():
-                self.__add_expression_string(nested_expression)
+    def __iter_expressions(self, expressions):
+        for expression in expressions:
+            yield expression
+            if isinstance(expression, Folder):
+                yield from self.__iter_expressions(expression.get_expressions())
 
     def append(self, expression):
         self.expressions.append(expression)
 
-    def __push_to_calc(self):
-        self.string_lines.append("Calc.setState(state);")
-
 
 class Line:
+    # The serialized expression is kept until a setter changes the line, so
+    # output of a mostly unchanged graph only rebuilds the edited lines
+    __slots__ = ("__string", "__extra_fields")
+
     def __init__(self):
-        pass
+        self.__string = None
+        self.__extra_fields = None
 
     def to_string(self):
-        fields = self._get_fields()
+        string = self.__string
+        if string is not None:
+            cache_stats["hits"] += 1
+            return string
+
+        fields = self._all_fields()
 
         fields = {k: v for (k, v) in fields.items() if v is not None}
 
-        return convert_to_string(fields)
+        string = self.__string = convert_to_string(fields)
+        cache_stats["misses"] += 1
+        cache_stats["bytes"] += len(string)
+        return string
+
+    def _invalidate(self):
+        self.__string = None
+
+    def to_state(self):
+        return convert_to_state(self._all_fields())
+
+    @classmethod
+    def from_state(cls, state):
+        line = cls()
+        line._set_fields(state)
+        return line
+
+    def get_id(self):
+        return self._get_fields().get("id")
+
+    def iter_strings(self):
+        yield self.to_string()
+
+    def iter_states(self):
+        yield self.to_state()
+
+    def iter_items(self):
+        yield self.get_id(), self.to_string()
+
+    def iter_styles(self):
+        return iter(())
+
+    def replace_styles(self, variables):
+        pass
 
     def _get_fields(self):
         return {}
 
+    def _all_fields(self):
+        fields = self._get_fields()
+        if self.__extra_fields:
+            fields = dict(fields, **self.__extra_fields)
+        return fields
+
+    def _set_fields(self, fields):
+        pass
+
+    def _keep_extra_fields(self, fields):
+        # State keys the class has no setter for, such as color, slider or
+        # description, are written back unchanged
+        known = self._get_fields()
+        self.__extra_fields = {k: v for (k, v) in fields.items() if k not in known} or None
+
+
+class StateLine(Line):
+    # An expression list entry of a type this module has no class for, kept as
+    # the state it was read from
+    __slots__ = ("__fields",)
+
+    def __init__(self, fields=None):
+        super().__init__()
+        self.__fields = dict(fields or {})
+
+    def _get_fields(self):
+        return self.__fields
+
+    def _set_fields(self, fields):
+        self._invalidate()
+        self.__fields = dict(fields)
+
+    def add_to_folder(self, folder_id: str):
+        self._invalidate()
+        self.__fields["folderId"] = folder_id
+
 
 class Expression(Line):
+    __slots__ = (
+        "__type",
+        "__latex",
+        "__color_latex",
+        "__line_style",
+        "__line_width",
+        "__line_opacity",
+        "__point_style",
+        "__point_size",
+        "__point_opacity",
+        "__fill_opacity",
+        "__points",
+        "__lines",
+        "__fill",
+        "__hidden",
+        "__readonly",
+        "__slider_bounds",
+        "__playing",
+        "__parametric_domain",
+        "__polar_domain",
+        "__id",
+        "__drag_mode",
+        "__label",
+        "__show_label",
+        "__label_size",
+        "__label_orientation",
+        "__clickable_info",
+        "__folder_id",
+    )
+
     def __init__(self):
         super().__init__()
         self.__type = "expression"
@@ -234,6 +974,7 @@ class Expression(Line):
     def _get_fields(self):
         return {
             "type": self.__type,
+            "id": self.__id,
             "latex": self.__latex,
             "colorLatex": self.__color_latex,
             "lineStyle": self.__line_style,
@@ -261,121 +1002,427 @@ class Expression(Line):
             "folderId": self.__folder_id,
         }
 
+    def _set_fields(self, fields):
+        self._invalidate()
+        fields = _restore_enums(dict(fields))
+        self.__id = fields.get("id")
+        self.__latex = fields.get("latex")
+        self.__color_latex = fields.get("colorLatex")
+        self.__line_style = fields.get("lineStyle")
+        self.__line_width = fields.get("lineWidth")
+        self.__line_opacity = fields.get("lineOpacity")
+        self.__point_style = fields.get("pointStyle")
+        self.__point_size = fields.get("pointSize")
+        self.__point_opacity = fields.get("pointOpacity")
+        self.__fill_opacity = fields.get("fillOpacity")
+        self.__points = fields.get("points")
+        self.__lines = fields.get("lines")
+        self.__fill = fields.get("fill")
+        self.__hidden = fields.get("hidden")
+        self.__readonly = fields.get("readonly")
+        self.__slider_bounds = fields.get("sliderBounds")
+        self.__playing = fields.get("playing")
+        self.__parametric_domain = fields.get("parametricDomain")
+        self.__polar_domain = fields.get("polarDomain")
+        self.__drag_mode = fields.get("dragMode")
+        self.__label = fields.get("label")
+        self.__show_label = fields.get("showLabel")
+        self.__label_size = fields.get("labelSize")
+        self.__label_orientation = fields.get("labelOrientation")
+        self.__clickable_info = fields.get("clickableInfo")
+        self.__folder_id = fields.get("folderId")
+        self._keep_extra_fields(fields)
+
+    def iter_styles(self):
+        yield "color", self.__color_latex
+        yield "number", self.__line_width
+        yield "number", self.__line_opacity
+        yield "number", self.__point_size
+        yield "number", self.__point_opacity
+        yield "number", self.__fill_opacity
+
+    def replace_styles(self, variables):
+        self._invalidate()
+        self.__color_latex = variables.get(("color", self.__color_latex), self.__color_latex)
+        self.__line_width = variables.get(("number", self.__line_width), self.__line_width)
+        self.__line_opacity = variables.get(("number", self.__line_opacity), self.__line_opacity)
+        self.__point_size = variables.get(("number", self.__point_size), self.__point_size)
+        self.__point_opacity = variables.get(("number", self.__point_opacity), self.__point_opacity)
+        self.__fill_opacity = variables.get(("number", self.__fill_opacity), self.__fill_opacity)
+
+    def set_id(self, expression_id: str):
+        self._invalidate()
+        self.__id = expression_id
+
     def set_latex(self, latex: str):
+        self._invalidate()
         self.__latex = clean_latex(latex)
 
+    def set_polygon(self, points):
+        self._invalidate()
+        self.__latex = polygon_latex(points)
+
+    def set_polygons(self, polygons):
+        self._invalidate()
+        self.__latex = polygons_latex(polygons)
+
+    def set_rectangles(self, bounds):
+        self._invalidate()
+        self.__latex = rectangles_latex(bounds)
+
     def append_latex(self, latex: str):
+        self._invalidate()
         self.__latex += clean_latex(latex)
 
     def set_color_latex(self, latex: str):
+        self._invalidate()
         self.__color_latex = clean_latex(latex)
 
     def set_line_style(self, line_style: str):
-        line_style = line_style.upper()
-        line_styles = ["SOLID", "DASHED", "DOTTED"]
-        if line_style in line_styles:
-            self.__line_style = "Desmos.Styles." + line_style
+        self._invalidate()
+        line_style = _format_line_style(line_style)
+        if line_style is not None:
+            self.__line_style = line_style
 
     def set_line_width(self, width):
-        if isinstance(width, float) or isinstance(width, int):
-            self.__line_width = str(max(0.0, width))
-        elif isinstance(width, str):
-            self.__line_width = clean_latex(width)
+        self._invalidate()
+        width = _format_size(width)
+        if width is not None:
+            self.__line_width = width
 
     def set_line_opacity(self, line_opacity):
-        if isinstance(line_opacity, float) or isinstance(line_opacity, int):
-            line_opacity = max(0.0, line_opacity)
-            self.__line_opacity = str(min(1.0, line_opacity))
-        elif isinstance(line_opacity, str):
-            self.__line_opacity = clean_latex(line_opacity)
+        self._invalidate()
+        line_opacity = _format_opacity(line_opacity)
+        if line_opacity is not None:
+            self.__line_opacity = line_opacity
 
     def set_point_style(self, point_style: str):
-        point_style = point_style.upper()
-        point_styles = ["POINT", "OPEN", "CROSS"]
-        if point_style in point_styles:
-            self.__point_style = "Desmos.Styles." + point_style
+        self._invalidate()
+        point_style = _format_point_style(point_style)
+        if point_style is not None:
+            self.__point_style = point_style
 
     def set_point_size(self, point_size):
-        if isinstance(point_size, float) or isinstance(point_size, int):
-            self.__point_size = str(max(0.0, point_size))
-        elif isinstance(point_size, str):
-            self.__point_size = clean_latex(point_size)
+        self._invalidate()
+        point_size = _format_size(point_size)
+        if point_size is not None:
+            self.__point_size = point_size
 
     def set_point_opacity(self, point_opacity):
-        if isinstance(point_opacity, float) or isinstance(point_opacity, int):
-            point_opacity = max(0.0, point_opacity)
-            self.__point_opacity = str(min(1.0, point_opacity))
-        elif isinstance(point_opacity, str):
-            self.__point_opacity = clean_latex(point_opacity)
+        self._invalidate()
+        point_opacity = _format_opacity(point_opacity)
+        if point_opacity is not None:
+            self.__point_opacity = point_opacity
 
     def set_fill_opacity(self, fill_opacity):
-        if isinstance(fill_opacity, float) or isinstance(fill_opacity, int):
-            fill_opacity = max(0.0, fill_opacity)
-            self.__fill_opacity = str(min(1.0, fill_opacity))
-        elif isinstance(fill_opacity, str):
-            self.__fill_opacity = clean_latex(fill_opacity)
+        self._invalidate()
+        fill_opacity = _format_opacity(fill_opacity)
+        if fill_opacity is not None:
+            self.__fill_opacity = fill_opacity
 
     def set_points(self, points: bool):
+        self._invalidate()
         self.__points = points
 
     def set_lines(self, lines: bool):
+        self._invalidate()
         self.__lines = lines
 
     def set_fill(self, fill: bool):
+        self._invalidate()
         self.__fill = fill
 
     def set_hidden(self, hidden: bool):
+        self._invalidate()
         self.__hidden = hidden
 
     def set_readonly(self, readonly: bool):
+        self._invalidate()
         self.__readonly = readonly
 
     def set_slider_bounds(self, lower_bound: str = None, upper_bound: str = None, step: str = None):
+        self._invalidate()
         self.__slider_bounds = {"min": lower_bound, "max": upper_bound, "step": step}
         self.__slider_bounds = {k: v for (k, v) in self.__slider_bounds.items() if v is not None}
 
     def set_playing(self, playing: bool):
+        self._invalidate()
         self.__playing = playing
 
     def set_parametric_domain(self, lower_bound: str = None, upper_bound: str = None):
+        self._invalidate()
         self.__parametric_domain = {"min": lower_bound, "max": upper_bound}
         self.__parametric_domain = {k: v for (k, v) in self.__parametric_domain.items() if v is not None}
 
     def set_polar_domain(self, lower_bound: str = None, upper_bound: str = None):
+        self._invalidate()
         self.__polar_domain = {"min": lower_bound, "max": upper_bound}
         self.__polar_domain = {k: v for (k, v) in self.__polar_domain.items() if v is not None}
 
     def set_drag_mode(self, drag_mode: str):
+        self._invalidate()
         drag_mode = drag_mode.upper()
         drag_modes = ["X", "Y", "XY", "NONE"]
         if drag_mode in drag_modes:
             self.__drag_mode = "Desmos.DragModes." + drag_mode
 
     def set_label(self, label: str):
+        self._invalidate()
         self.__label = label
 
     def set_show_label(self, show_label: bool):
+        self._invalidate()
         self.__show_label = show_label
 
     def set_label_size(self, label_size: str):
+        self._invalidate()
         self.__label_size = clean_latex(label_size)
 
     def set_label_orientation(self, orientation: str):
+        self._invalidate()
         orientation = orientation.upper()
         orientations = ["ABOVE", "BELOW", "LEFT", "RIGHT", "DEFAULT"]
         if orientation in orientations:
             self.__drag_mode = "Desmos.LabelOrientations." + orientation
 
     def set_clickable_info(self, latex: str, enabled: bool = True):
+        self._invalidate()
         self.__clickable_info = {"enabled": enabled, "latex": clean_latex(latex)}
 
     def add_to_folder(self, folder_id: str):
+        self._invalidate()
         if isinstance(self, Folder):
             return
         self.__folder_id = folder_id
 
 
+# Formatters shared by the Expression setters and the ExpressionBatch columns
+def _format_size(value):
+    if isinstance(value, float) or isinstance(value, int):
+        return str(max(0.0, value))
+    elif isinstance(value, str):
+        return clean_latex(value)
+
+
+def _format_opacity(value):
+    if isinstance(value, float) or isinstance(value, int):
+        value = max(0.0, value)
+        return str(min(1.0, value))
+    elif isinstance(value, str):
+        return clean_latex(value)
+
+
+def _format_id(value):
+    if value is not None:
+        return str(value)
+
+
+def _format_latex(value):
+    if value is not None:
+        return clean_latex(value)
+
+
+def _format_line_style(value):
+    if value is not None and value.upper() in ["SOLID", "DASHED", "DOTTED"]:
+        return "Desmos.Styles." + value.upper()
+
+
+def _format_point_style(value):
+    if value is not None and value.upper() in ["POINT", "OPEN", "CROSS"]:
+        return "Desmos.Styles." + value.upper()
+
+
+def _format_bool(value):
+    if value is not None:
+        return bool(value)
+
+
+def _format_polygon(value):
+    if value is not None:
+        return polygon_latex(value)
+
+
+def _format_polygons(value):
+    if value is not None:
+        return polygons_latex(value)
+
+
+def _format_rectangles(value):
+    if value is not None:
+        return rectangles_latex(value)
+
+
+def _is_scalar(value):
+    return value is None or isinstance(value, str) or not hasattr(value, "__len__")
+
+
+class ExpressionBatch:
+    # Columns in the same order Expression._get_fields emits them, with the
+    # formatter the matching Expression setter applies
+    _column_fields = {
+        "id": ("id", _format_id),
+        "latex": ("latex", _format_latex),
+        "color_latex": ("colorLatex", _format_latex),
+        "line_style": ("lineStyle", _format_line_style),
+        "line_width": ("lineWidth", _format_size),
+        "line_opacity": ("lineOpacity", _format_opacity),
+        "point_style": ("pointStyle", _format_point_style),
+        "point_size": ("pointSize", _format_size),
+        "point_opacity": ("pointOpacity", _format_opacity),
+        "fill_opacity": ("fillOpacity", _format_opacity),
+        "points": ("points", _format_bool),
+        "lines": ("lines", _format_bool),
+        "fill": ("fill", _format_bool),
+        "hidden": ("hidden", _format_bool),
+    }
+
+    # Columns filling the latex column like set_polygon, set_polygons and
+    # set_rectangles, without cleaning the latex they build. Their values are
+    # always given per row.
+    _latex_columns = {
+        "polygon": _format_polygon,
+        "polygons": _format_polygons,
+        "rectangles": _format_rectangles,
+    }
+
+    # Columns that hold style values, by kind of value
+    _style_columns = {
+        "color_latex": "color",
+        "line_width": "number",
+        "line_opacity": "number",
+        "point_size": "number",
+        "point_opacity": "number",
+        "fill_opacity": "number",
+    }
+
+    __slots__ = ("__length", "__columns", "__folder_id", "__cache_rows", "__items")
+
+    def __init__(self, cache_rows: bool = False):
+        # With cache_rows the serialized rows are kept until the batch changes,
+        # which holds every row's string in memory
+        self.__length = 0
+        self.__columns = {}
+        self.__folder_id = None
+        self.__cache_rows = cache_rows
+        self.__items = None
+
+    def __len__(self):
+        return self.__length
+
+    def append(self, **values):
+        self.extend(**{k: [v] for (k, v) in values.items()})
+
+    def extend(self, **values):
+        self.__items = None
+        for name in values:
+            if name not in self._column_fields and name not in self._latex_columns:
+                raise TypeError("Unknown ExpressionBatch column: " + name)
+
+        formatters = {}
+        shapes = [name for name in self._latex_columns if name in values]
+        if shapes:
+            if len(shapes) > 1 or "latex" in values:
+                raise TypeError("Only one of the latex, " + ", ".join(self._latex_columns)
+                                + " columns can be given at once")
+            values = dict(values)
+            values["latex"] = list(values.pop(shapes[0]))
+            formatters["latex"] = self._latex_columns[shapes[0]]
+
+        sequences = {k: v for (k, v) in values.items() if not _is_scalar(v)}
+        lengths = {len(v) for v in sequences.values()}
+        if len(lengths) > 1:
+            raise ValueError("ExpressionBatch columns must all have the same length")
+        count = lengths.pop() if lengths else 1
+
+        for name, (field, formatter) in self._column_fields.items():
+            value = values.get(name)
+            formatter = formatters.get(name, formatter)
+            if name in sequences:
+                if hasattr(value, "tolist"):
+                    value = value.tolist()
+                column = [formatter(n) for n in value]
+            else:
+                column = [formatter(value)] * count
+
+            if name in self.__columns:
+                self.__columns[name].extend(column)
+            elif name in values:
+                self.__columns[name] = [None] * self.__length + column
+
+        self.__length += count
+
+    def get_column(self, name: str):
+        return self.__columns.get(name, [None] * self.__length)
+
+    def add_to_folder(self, folder_id: str):
+        self.__items = None
+        self.__folder_id = folder_id
+
+    def iter_fields(self):
+        names = [field for (name, (field, _)) in self._column_fields.items() if name in self.__columns]
+        columns = [self.__columns[name] for name in self._column_fields if name in self.__columns]
+        rows = zip(*columns) if columns else [()] * self.__length
+        for row in rows:
+            fields = {"type": "expression"}
+            for name, value in zip(names, row):
+                if value is not None:
+                    fields[name] = value
+            if self.__folder_id is not None:
+                fields["folderId"] = self.__folder_id
+            yield fields
+
+    def iter_strings(self):
+        for _, string in self.iter_items():
+            yield string
+
+    def iter_states(self):
+        for fields in self.iter_fields():
+            yield convert_to_state(fields)
+
+    def iter_items(self):
+        if self.__items is not None:
+            cache_stats["hits"] += len(self.__items)
+            return iter(self.__items)
+        if not self.__cache_rows:
+            return self.__iter_rows()
+        self.__items = list(self.__iter_rows())
+        return iter(self.__items)
+
+    def __iter_rows(self):
+        for fields in self.iter_fields():
+            string = convert_to_string(fields)
+            cache_stats["misses"] += 1
+            cache_stats["bytes"] += len(string)
+            yield fields.get("id"), string
+
+    def _invalidate(self):
+        self.__items = None
+
+    def iter_styles(self):
+        for name, kind in self._style_columns.items():
+            for value in self.__columns.get(name, ()):
+                yield kind, value
+
+    def replace_styles(self, variables):
+        self.__items = None
+        for name, kind in self._style_columns.items():
+            if name in self.__columns:
+                self.__columns[name] = [variables.get((kind, n), n) for n in self.__columns[name]]
+
+
 class Folder(Line):
+    __slots__ = (
+        "__type",
+        "__id",
+        "__collapsed",
+        "__title",
+        "__hidden",
+        "__secret",
+        "__readonly",
+        "__expressions",
+        "__pending",
+    )
+
     def __init__(self):
         super().__init__()
         self.__type = "folder"
@@ -386,6 +1433,8 @@ class Folder(Line):
         self.__secret = None
         self.__readonly = None
         self.__expressions = []
+        # Contents read lazily by Graph.from_state, as JSON not yet parsed
+        self.__pending = []
 
     def _get_fields(self):
         return {
@@ -398,19 +1447,40 @@ class Folder(Line):
             "readonly": self.__readonly
         }
 
+    def _set_fields(self, fields):
+        self._invalidate()
+        self.__id = fields.get("id", self.__id)
+        self.__title = fields.get("title")
+        self.__collapsed = fields.get("collapsed")
+        self.__hidden = fields.get("hidden")
+        self.__secret = fields.get("secret")
+        self.__readonly = fields.get("readonly")
+        self._keep_extra_fields(fields)
+
+    def set_id(self, folder_id: str):
+        self._invalidate()
+        self.__id = folder_id
+        for expression in self.get_expressions():
+            expression.add_to_folder(folder_id)
+
     def set_title(self, title: str):
+        self._invalidate()
         self.__title = title
 
     def set_collapsed(self, collapsed: bool):
+        self._invalidate()
         self.__collapsed = collapsed
 
     def set_hidden(self, hidden: bool):
+        self._invalidate()
         self.__hidden = hidden
 
     def set_secret(self, secret: bool):
+        self._invalidate()
         self.__secret = secret
 
     def set_readonly(self, readonly: bool):
+        self._invalidate()
         self.__readonly = readonly
 
     def add_expression(self, expression: Expression):
@@ -424,11 +1494,42 @@ class Folder(Line):
         for expression in expressions:
             self.add_expression(expression)
 
+    def add_pending(self, state_json: str):
+        self.__pending.append(state_json)
+
+    def is_loaded(self):
+        return not self.__pending
+
     def get_expressions(self):
+        if self.__pending:
+            pending = self.__pending
+            self.__pending = []
+            for state_json in pending:
+                self.add_expression(line_from_state(json.loads(state_json)))
         return self.__expressions
 
 
+def _column_values(values):
+    if isinstance(values, np.ndarray) or not isinstance(values, (list, tuple)):
+        values = np.array(values)
+        if values.dtype.kind in "biuf":
+            return values.ravel()
+        values = values.tolist()
+    if all(isinstance(n, (int, float)) for n in values):
+        return np.array(values, dtype=np.float64 if any(isinstance(n, float) for n in values) else np.int64)
+    return [clean_latex(n) if isinstance(n, str) else format_numbers([n])[0] for n in values]
+
+
 class Table(Line):
+    __slots__ = (
+        "__type",
+        "__id",
+        "__columns",
+        "__regression",
+        "__readonly",
+        "__folder_id",
+    )
+
     def __init__(self):
         super().__init__()
         self.__type = "table"
@@ -436,45 +1537,107 @@ class Table(Line):
         self.__columns = []
         self.__regression = None
         self.__readonly = None
+        self.__folder_id = None
 
     def _get_fields(self):
+        columns = self.__columns
+        if any(isinstance(n.get("values"), np.ndarray) for n in columns):
+            columns = [dict(n, values=format_numbers(n["values"])) if isinstance(n.get("values"), np.ndarray) else n
+                       for n in columns]
         return {
             "type": self.__type,
             "id": self.__id,
-            "columns": self.__columns,
+            "columns": columns,
             "regression": self.__regression,
             "readonly": self.__readonly,
+            "folderId": self.__folder_id,
         }
 
+    def _set_fields(self, fields):
+        self._invalidate()
+        self.__id = fields.get("id", self.__id)
+        self.__columns = [_restore_enums(dict(n)) for n in fields.get("columns", [])]
+        regression = fields.get("regression")
+        self.__regression = None if regression is None else _restore_enums(dict(regression))
+        self.__readonly = fields.get("readonly")
+        self.__folder_id = fields.get("folderId")
+        self._keep_extra_fields(fields)
+
+    def add_to_folder(self, folder_id: str):
+        self._invalidate()
+        self.__folder_id = folder_id
+
+    # Column fields that hold style values, by kind of value
+    _style_fields = {
+        "color": "color",
+        "lineWidth": "number",
+        "lineOpacity": "number",
+        "pointSize": "number",
+        "pointOpacity": "number",
+    }
+
+    def iter_styles(self):
+        for column in self.__columns:
+            for field, kind in self._style_fields.items():
+                yield kind, column.get(field)
+
+    def replace_styles(self, variables):
+        self._invalidate()
+        for column in self.__columns:
+            for field, kind in self._style_fields.items():
+                if field in column:
+                    column[field] = variables.get((kind, column[field]), column[field])
+
+    def set_id(self, table_id: str):
+        self._invalidate()
+        self.__id = table_id
+
     def add_column(self):
+        self._invalidate()
         self.__columns.append({})
         self.__columns[-1]["id"] = str(random.randint(-2147483648, 2147483647))
 
     def set_column_latex(self, column_number: int, latex: str):
+        self._invalidate()
         if 0 <= column_number < len(self.__columns):
             self.__columns[column_number]["latex"] = clean_latex(latex)
 
-    def set_column_values(self, column_number: int, latex_array: [str]):
+    def set_column_values(self, column_number: int, latex_array):
+        # Numeric arrays and buffers are kept as a NumPy array and formatted on
+        # output, only string cells go through clean_latex
+        self._invalidate()
         if 0 <= column_number < len(self.__columns):
-            self.__columns[column_number]["values"] = [clean_latex(n) for n in latex_array]
+            self.__columns[column_number]["values"] = _column_values(latex_array)
+
+    def add_columns(self, columns: dict):
+        # Adds one column per header latex, filled with the given values
+        for latex, values in columns.items():
+            self.add_column()
+            self.set_column_latex(len(self.__columns) - 1, latex)
+            self.set_column_values(len(self.__columns) - 1, values)
 
     def set_column_color(self, column_number: int, color_latex: str):
+        self._invalidate()
         if 0 <= column_number < len(self.__columns):
             self.__columns[column_number]["color"] = clean_latex(color_latex)
 
     def set_column_hidden(self, column_number: int, hidden: bool):
+        self._invalidate()
         if 0 <= column_number < len(self.__columns):
             self.__columns[column_number]["hidden"] = hidden
 
     def set_column_points(self, column_number: int, points: bool):
+        self._invalidate()
         if 0 <= column_number < len(self.__columns):
             self.__columns[column_number]["points"] = points
 
     def set_column_lines(self, column_number: int, lines: bool):
+        self._invalidate()
         if 0 <= column_number < len(self.__columns):
             self.__columns[column_number]["lines"] = lines
 
     def set_column_line_style(self, column_number: int, line_style: str):
+        self._invalidate()
         if 0 <= column_number < len(self.__columns):
             line_style = line_style.upper()
             line_styles = ["SOLID", "DASHED", "DOTTED"]
@@ -482,6 +1645,7 @@ class Table(Line):
                 self.__columns[column_number]["lineStyle"] = "Desmos.Styles." + line_style
 
     def set_column_line_width(self, column_number: int, width):
+        self._invalidate()
         if 0 <= column_number < len(self.__columns):
             if isinstance(width, float) or isinstance(width, int):
                 self.__columns[column_number]["lineWidth"] = str(max(0.0, width))
@@ -489,6 +1653,7 @@ class Table(Line):
                 self.__columns[column_number]["lineWidth"] = clean_latex(width)
 
     def set_column_line_opacity(self, column_number: int, opacity):
+        self._invalidate()
         if 0 <= column_number < len(self.__columns):
             if isinstance(opacity, float) or isinstance(opacity, int):
                 opacity = max(0.0, opacity)
@@ -497,6 +1662,7 @@ class Table(Line):
                 self.__columns[column_number]["lineOpacity"] = clean_latex(opacity)
 
     def set_column_point_style(self, column_number: int, point_style: str):
+        self._invalidate()
         if 0 <= column_number < len(self.__columns):
             point_style = point_style.upper()
             point_styles = ["POINT", "OPEN", "CROSS"]
@@ -504,6 +1670,7 @@ class Table(Line):
                 self.__columns[column_number]["pointStyle"] = "Desmos.Styles." + point_style
 
     def set_column_point_size(self, column_number: int, size):
+        self._invalidate()
         if 0 <= column_number < len(self.__columns):
             if isinstance(size, float) or isinstance(size, int):
                 self.__columns[column_number]["pointSize"] = str(max(0.0, size))
@@ -511,6 +1678,7 @@ class Table(Line):
                 self.__columns[column_number]["pointSize"] = clean_latex(size)
 
     def set_column_point_opacity(self, column_number: int, opacity: float):
+        self._invalidate()
         if 0 <= column_number < len(self.__columns):
             if isinstance(opacity, float) or isinstance(opacity, int):
                 opacity = max(0.0, opacity)
@@ -519,6 +1687,7 @@ class Table(Line):
                 self.__columns[column_number]["pointOpacity"] = clean_latex(opacity)
 
     def set_column_drag_mode(self, column_number: int, drag_mode: str):
+        self._invalidate()
         if 0 <= column_number < len(self.__columns):
             drag_mode = drag_mode.upper()
             drag_modes = ["X", "Y", "XY", "NONE"]
@@ -526,17 +1695,21 @@ class Table(Line):
                 self.__columns[column_number]["dragMode"] = "Desmos.DragModes." + drag_mode
 
     def add_regression(self):
+        self._invalidate()
         self.__regression = {}
 
     def remove_regression(self):
+        self._invalidate()
         self.__regression = None
 
     def set_regression_color(self, color_latex: str):
+        self._invalidate()
         if self.__regression is None:
             return
         self.__regression["color"] = clean_latex(color_latex)
 
     def set_regression_columns(self, x_column_index, y_column_index):
+        self._invalidate()
         if self.__regression is None:
             return
         x_column_id = self.__columns[x_column_index].get("id")
@@ -546,16 +1719,19 @@ class Table(Line):
         self.__regression["columnIds"]["y"] = y_column_id
 
     def set_regression_hidden(self, hidden: bool):
+        self._invalidate()
         if self.__regression is None:
             return
         self.__regression["hidden"] = hidden
 
     def set_regression_log_mode(self, log_mode: bool):
+        self._invalidate()
         if self.__regression is None:
             return
         self.__regression["isLogMode"] = log_mode
 
     def set_regression_line_style(self, line_style: str):
+        self._invalidate()
         if self.__regression is None:
             return
         line_style = line_style.upper()
@@ -564,11 +1740,13 @@ class Table(Line):
             self.__regression["lineStyle"] = "Desmos.Styles." + line_style
 
     def set_regression_residual_variable(self, residual_variable: str):
+        self._invalidate()
         if self.__regression is None:
             return
         self.__regression["residualVariable"] = clean_latex(residual_variable)
 
     def set_regression_type(self, regression_type: str):
+        self._invalidate()
         if self.__regression is None:
             return
         regression_type = regression_type.lower()
@@ -577,25 +1755,56 @@ class Table(Line):
             self.__regression["type"] = regression_type
 
     def set_readonly(self, readonly: bool):
+        self._invalidate()
         self.__readonly = readonly
 
 
 class Text(Line):
+    __slots__ = (
+        "__type",
+        "__id",
+        "__text",
+        "__readonly",
+        "__folder_id",
+    )
+
     def __init__(self):
         super().__init__()
         self.__type = "text"
+        self.__id = None
         self.__text = None
         self.__readonly = None
+        self.__folder_id = None
 
     def _get_fields(self):
         return {
             "type": self.__type,
+            "id": self.__id,
             "text": self.__text,
-            "readonly": self.__readonly
+            "readonly": self.__readonly,
+            "folderId": self.__folder_id,
         }
 
+    def _set_fields(self, fields):
+        self._invalidate()
+        self.__id = fields.get("id")
+        self.__text = fields.get("text")
+        self.__readonly = fields.get("readonly")
+        self.__folder_id = fields.get("folderId")
+        self._keep_extra_fields(fields)
+
+    def add_to_folder(self, folder_id: str):
+        self._invalidate()
+        self.__folder_id = folder_id
+
+    def set_id(self, text_id: str):
+        self._invalidate()
+        self.__id = text_id
+
     def set_text(self, text: str):
+        self._invalidate()
         self.__text = text
 
     def set_readonly(self, readonly: bool):
+        self._invalidate()
         self.__readonly = readonly
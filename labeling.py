@@ -0,0 +1,240 @@
+import collections
+import os
+
+import numpy as np
+
+
+LabelResult = collections.namedtuple("LabelResult", ["labels", "colors", "bboxes", "areas"])
+
+# Rows converted to RGBA at a time when an image is packed, bounds the
+# temporary copies to a band instead of the whole image
+BAND_HEIGHT = 256
+
+netpbm_extensions = [".pgm", ".ppm", ".pnm", ".pam"]
+
+
+def image_to_array(image):
+    if isinstance(image, np.ndarray):
+        return image
+    return np.asarray(image.convert("RGBA"))
+
+
+def pack_colors(pixels):
+    # (H, W, 4) uint8 -> (H, W) uint32, a view when the input is contiguous RGBA.
+    # Gray, gray and alpha and RGB pixels are expanded to RGBA first.
+    pixels = np.asarray(pixels)
+    if pixels.ndim == 2:
+        return pixels.astype(np.uint32, copy=False)
+    if pixels.shape[2] not in (1, 2, 3, 4):
+        raise ValueError("Pixels need 1 to 4 channels (gray, gray and alpha, RGB or RGBA), got "
+                         + str(pixels.shape[2]))
+    if pixels.shape[2] <= 2:
+        pixels = pixels[..., [0, 0, 0] + list(range(1, pixels.shape[2]))]
+    if pixels.shape[2] == 3:
+        alpha = np.full(pixels.shape[:2] + (1,), 255, dtype=np.uint8)
+        pixels = np.concatenate([pixels, alpha], axis=2)
+    pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+    return pixels.view(np.uint32)[..., 0]
+
+
+def _read_netpbm_header(f):
+    # Returns the header fields and the offset of the pixel data
+    magic = f.read(2)
+    if magic not in (b"P5", b"P6", b"P7"):
+        raise ValueError("Only binary PGM, PPM and PAM files can be mapped, got " + repr(magic))
+    fields = {}
+    if magic == b"P7":
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError("PAM header has no ENDHDR")
+            words = line.split(b"#")[0].split()
+            if words == [b"ENDHDR"]:
+                break
+            if words:
+                fields[words[0].decode()] = words[1].decode() if len(words) > 1 else ""
+        return int(fields["WIDTH"]), int(fields["HEIGHT"]), int(fields["DEPTH"]), int(fields["MAXVAL"]), f.tell()
+
+    values = []
+    while len(values) < 3:
+        line = f.readline()
+        if not line:
+            raise ValueError("Truncated netpbm header")
+        values += line.split(b"#")[0].split()
+    width, height, maxval = (int(n) for n in values[:3])
+    return width, height, 1 if magic == b"P5" else 3, maxval, f.tell()
+
+
+def open_netpbm(path):
+    # Maps the pixels of a binary PGM, PPM or PAM file as a read only
+    # (H, W, channels) array, nothing is read until it is used
+    with open(path, "rb") as f:
+        width, height, depth, maxval, offset = _read_netpbm_header(f)
+    if maxval != 255:
+        raise ValueError("Only 8 bit netpbm files can be mapped, maxval is " + str(maxval))
+    if depth not in (1, 2, 3, 4):
+        raise ValueError("Only PAM files of depth 1 to 4 can be read, depth is " + str(depth))
+    return np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=(height, width, depth))
+
+
+def open_raw(path, width, height, channels=4, offset=0):
+    # Maps a headerless file of 8 bit pixels, row after row
+    return np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=(height, width, channels))
+
+
+def open_image(source):
+    # Netpbm files are memory mapped, anything else is opened lazily with PIL
+    if not isinstance(source, (str, os.PathLike)):
+        return source
+    if os.path.splitext(os.fspath(source))[1].lower() in netpbm_extensions:
+        return open_netpbm(source)
+    from PIL import Image
+    return Image.open(source)
+
+
+def iter_row_bands(image, band_height=BAND_HEIGHT):
+    # Yields (top, rows) one band at a time, rows of an array keep its channels
+    # and rows of a PIL image are RGBA
+    if isinstance(image, np.ndarray):
+        height = image.shape[0]
+        for top in range(0, height, band_height):
+            yield top, np.asarray(image[top:top + band_height])
+    else:
+        for top in range(0, image.height, band_height):
+            band = image.crop((0, top, image.width, min(top + band_height, image.height)))
+            yield top, np.asarray(band.convert("RGBA"))
+
+
+def read_pixels(image, band_height=BAND_HEIGHT):
+    # Packs an image, array or memory map into one (H, W) uint32 array, reading
+    # it a band of rows at a time
+    if isinstance(image, np.ndarray) and image.ndim == 2:
+        return image.astype(np.uint32, copy=False)
+    height, width = (image.shape[:2] if isinstance(image, np.ndarray) else (image.height, image.width))
+    packed = np.empty((height, width), dtype=np.uint32)
+    for top, rows in iter_row_bands(image, band_height):
+        packed[top:top + len(rows)] = pack_colors(rows)
+    return packed
+
+
+def unpack_colors(packed):
+    packed = np.ascontiguousarray(packed, dtype=np.uint32)
+    return packed[..., None].view(np.uint8)
+
+
+def find_runs(packed):
+    height, width = packed.shape
+    flat = packed.ravel()
+
+    # A run starts at every row start and wherever the color changes
+    starts = np.ones(flat.shape, dtype=bool)
+    starts[1:] = flat[1:] != flat[:-1]
+    starts[::width] = True
+    run_starts = np.flatnonzero(starts)
+    run_ends = np.append(run_starts[1:], flat.size)
+
+    run_rows = run_starts // width
+    run_x0 = run_starts - run_rows * width
+    run_x1 = run_ends - run_rows * width
+    return run_rows, run_x0, run_x1, flat[run_starts]
+
+
+def _run_edges(run_ids, run_rows, run_x0, run_x1, run_colors, diagonals):
+    width = run_ids.shape[1]
+    reach = 1 if diagonals else 0
+
+    below = np.flatnonzero(run_rows > 0)
+    above_row = run_rows[below] - 1
+    first = run_ids[above_row, np.maximum(run_x0[below] - reach, 0)]
+    last = run_ids[above_row, np.minimum(run_x1[below] - 1 + reach, width - 1)]
+
+    # Runs in a row partition it, so the overlapping runs above are the index range first..last
+    counts = last - first + 1
+    b = np.repeat(below, counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    a = np.repeat(first, counts) + offsets
+
+    same_color = run_colors[a] == run_colors[b]
+    a = a[same_color]
+    b = b[same_color]
+
+    if diagonals:
+        # Where both diagonals of a 2x2 block have one color each, only the top
+        # left to bottom right pair is joined, so no two patches cross. The
+        # tracer and the band seams resolve crossings the same way.
+        anti = np.flatnonzero(run_x0[a] == run_x1[b])
+        rows = run_rows[b[anti]]
+        x = run_x0[a[anti]]
+        crossing = run_colors[run_ids[rows - 1, x - 1]] == run_colors[run_ids[rows, x]]
+        keep = np.ones(len(a), dtype=bool)
+        keep[anti[crossing]] = False
+        a = a[keep]
+        b = b[keep]
+    return a, b
+
+
+def connected_roots(n, a, b):
+    # Vectorized union-find: hook larger roots onto smaller ones, then compress paths
+    parent = np.arange(n)
+    while len(a) > 0:
+        pa = parent[a]
+        pb = parent[b]
+        unmerged = pa != pb
+        if not unmerged.any():
+            break
+        a = a[unmerged]
+        b = b[unmerged]
+        pa = pa[unmerged]
+        pb = pb[unmerged]
+        np.minimum.at(parent, np.maximum(pa, pb), np.minimum(pa, pb))
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+    return parent
+
+
+def label_image(image, diagonals=False):
+    packed = pack_colors(image_to_array(image))
+    height, width = packed.shape
+
+    run_rows, run_x0, run_x1, run_colors = find_runs(packed)
+    run_lengths = run_x1 - run_x0
+    run_ids = np.repeat(np.arange(len(run_rows)), run_lengths).reshape(height, width)
+
+    a, b = _run_edges(run_ids, run_rows, run_x0, run_x1, run_colors, diagonals)
+    roots = connected_roots(len(run_rows), a, b)
+
+    # Roots are the first run of each component in raster order, so labels come out in raster order too
+    _, run_labels = np.unique(roots, return_inverse=True)
+    count = run_labels.max() + 1 if len(run_labels) else 0
+
+    labels = run_labels[run_ids]
+
+    colors = np.zeros(count, dtype=np.uint32)
+    colors[run_labels] = run_colors
+
+    bboxes = np.empty((count, 4), dtype=np.int64)
+    bboxes[:, 0] = width
+    bboxes[:, 1] = height
+    bboxes[:, 2] = 0
+    bboxes[:, 3] = 0
+    np.minimum.at(bboxes[:, 0], run_labels, run_x0)
+    np.minimum.at(bboxes[:, 1], run_labels, run_rows)
+    np.maximum.at(bboxes[:, 2], run_labels, run_x1)
+    np.maximum.at(bboxes[:, 3], run_labels, run_rows + 1)
+
+    areas = np.bincount(run_labels, weights=run_lengths, minlength=count).astype(np.int64)
+
+    return LabelResult(labels, colors, bboxes, areas)
+
+
+def label_points(labels):
+    # Pixel coordinates of every label as (x, y) arrays, grouped by label
+    height, width = labels.shape
+    order = np.argsort(labels, axis=None, kind="stable")
+    counts = np.bincount(labels.ravel())
+    ys, xs = np.divmod(order, width)
+    bounds = np.cumsum(counts)
+    return [(xs[start:end], ys[start:end]) for (start, end) in zip(bounds - counts, bounds)]
@@ -0,0 +1,120 @@
+import numpy as np
+
+import interface
+
+
+# Side of the square grid cells used to find polygons that may overlap
+CELL_SIZE = 32
+
+
+def polygon_bboxes(polygons):
+    # (x0, y0, x1, y1) of every polygon, reduced over all points at once
+    if len(polygons) == 0:
+        return np.zeros((0, 4), dtype=np.int64)
+    points = np.concatenate(polygons)
+    starts = np.cumsum([0] + [len(n) for n in polygons[:-1]])
+    return np.concatenate([np.minimum.reduceat(points, starts), np.maximum.reduceat(points, starts)], axis=1)
+
+
+def painter_order(bboxes):
+    # Largest bounding box area first, ties keep their order. A patch in a hole
+    # of another is surrounded by that patch's pixels on every side, so the
+    # enclosing patch has the strictly larger box and is drawn first. This
+    # needs labeling and tracing to resolve diagonal crossings the same way.
+    bboxes = np.asarray(bboxes)
+    areas = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
+    return np.argsort(-areas, kind="stable")
+
+
+def enclosing_labels(labels, contours):
+    # For every label, the label of the patch in whose hole it lies, -1 for none.
+    # The pixel above a patch's first pixel in raster order is outside the
+    # patch and its holes. It belongs either to the enclosing patch, across one
+    # of that patch's holes, or to a patch inside the same hole.
+    labels = np.asarray(labels)
+    height, width = labels.shape
+    _, first = np.unique(labels, return_index=True)
+    ys, xs = np.divmod(first, width)
+    above = np.where(ys > 0, labels.ravel()[np.maximum(first - width, 0)], -1)
+
+    # Hole edges heading west, keyed by label and start, the one above a first
+    # pixel (x, y) starts at (x + 1, y)
+    corners = (height + 1) * (width + 1)
+    hole_keys = [np.zeros(0, dtype=np.int64)]
+    for label, (_, *holes) in enumerate(contours):
+        for hole in holes:
+            ends = np.roll(hole, -1, axis=0)
+            west = hole[ends[:, 0] < hole[:, 0]]
+            hole_keys.append(label * corners + west[:, 1] * (width + 1) + west[:, 0])
+    keys = above * corners + ys * (width + 1) + xs + 1
+    in_hole = (above >= 0) & np.isin(keys, np.concatenate(hole_keys))
+
+    # The patch above comes first in raster order, so its own parent is known
+    parents = np.full(len(first), -1, dtype=np.int64)
+    for label in np.argsort(first).tolist():
+        if in_hole[label]:
+            parents[label] = above[label]
+        elif above[label] >= 0:
+            parents[label] = parents[above[label]]
+    return parents
+
+
+def containment_layers(parents, colors):
+    # Filled outlines of two patches are either nested or apart, so a patch only
+    # has to be drawn after the patches enclosing it. Its layer is its parent's,
+    # one higher when the colors differ.
+    layers = [None] * len(parents)
+    for start in range(len(parents)):
+        chain = []
+        label = start
+        while label >= 0 and layers[label] is None:
+            chain.append(label)
+            label = parents[label]
+        for label in reversed(chain):
+            parent = parents[label]
+            layers[label] = 0 if parent < 0 else layers[parent] + (colors[label] != colors[parent])
+    return np.array(layers, dtype=np.int64)
+
+
+def assign_layers(bboxes, colors, cell_size=CELL_SIZE):
+    # Polygons are given in painter's order. A polygon has to be drawn after
+    # every earlier polygon of another color that may overlap it, so its layer
+    # is one above the highest such polygon. Polygons of one color in one layer
+    # can then be drawn together without changing the picture. Overlap is
+    # decided per grid cell, touching boxes count since outlines spill over.
+    bboxes = np.asarray(bboxes)
+    cells = bboxes // cell_size
+    width = int(cells[:, 2].max(initial=0)) + 1
+    height = int(cells[:, 3].max(initial=0)) + 1
+
+    # Per cell, the highest layer and its color, and the highest layer of any other color
+    top_layer = np.full((height, width), -1, dtype=np.int64)
+    top_color = np.full((height, width), -1, dtype=np.int64)
+    second_layer = np.full((height, width), -1, dtype=np.int64)
+
+    layers = np.empty(len(bboxes), dtype=np.int64)
+    for i, ((x0, y0, x1, y1), color) in enumerate(zip(cells.tolist(), colors)):
+        block = (slice(y0, y1 + 1), slice(x0, x1 + 1))
+        top = top_layer[block]
+        same = top_color[block] == color
+        layer = int(np.where(same, second_layer[block], top).max()) + 1
+        layers[i] = layer
+
+        # layer is above every other color in the block, so it becomes the top of
+        # every cell whose top had another color
+        second_layer[block] = np.where(same, second_layer[block], top)
+        top_layer[block] = np.where(same, np.maximum(top, layer), layer)
+        top_color[block] = color
+
+    return layers
+
+
+def group_by_layer(items, colors, layers, max_length=interface.MAX_LIST_LENGTH):
+    # Groups items of one color in one layer, in drawing order, groups with
+    # more than max_length items are split over several
+    groups = {}
+    for item, color, layer in zip(items, colors, layers.tolist()):
+        groups.setdefault((layer, color), []).append(item)
+    return [(color, groups[(layer, color)][start:start + max_length])
+            for (layer, color) in sorted(groups, key=lambda n: n[0])
+            for start in range(0, len(groups[(layer, color)]), max_length)]
@@ -0,0 +1,78 @@
+import numpy as np
+
+import labeling
+
+
+def level_factors(levels, ratio):
+    # Downsampling factor of every level, coarsest first: 3 levels with a ratio
+    # of 4 -> [16, 4, 1]
+    return [ratio ** n for n in range(levels - 1, -1, -1)]
+
+
+def downsample(packed, factor):
+    # Keeps the top left pixel of every factor x factor block, so a quantized
+    # image keeps its palette
+    return packed[::factor, ::factor]
+
+
+def upsample(packed, factor, height, width):
+    return np.repeat(np.repeat(packed, factor, axis=0), factor, axis=1)[:height, :width]
+
+
+def unused_color(packed):
+    # A packed color the image does not use
+    used = np.unique(packed)
+    candidates = np.arange(len(used) + 1, dtype=np.uint32)
+    return candidates[~np.isin(candidates, used)][0]
+
+
+def fill_holes(mask, diagonals=False):
+    # Adds every region of ~mask that is cut off from the image border to mask.
+    # A traced polygon covers the holes of its patch, so pixels left out of a
+    # level must never be one. Patches joined diagonally separate the pixels
+    # around them only diagonally, and the other way round.
+    height, width = mask.shape
+    result = labeling.label_image(mask.astype(np.uint32), not diagonals)
+    bboxes = result.bboxes
+    outside = (bboxes[:, 0] == 0) | (bboxes[:, 1] == 0) | (bboxes[:, 2] == width) | (bboxes[:, 3] == height)
+    return mask | ~outside[result.labels]
+
+
+def changed_patches(level, changed, diagonals=False):
+    # Pixels of every patch with a changed pixel and of every patch those
+    # enclose. Redrawing whole patches keeps their outlines as short as in a
+    # single full output, where the changed pixels alone are slivers along
+    # every edge. A hole holds whole patches, so filling them adds no partial ones.
+    labels = labeling.label_image(level, diagonals).labels
+    redrawn = np.zeros(labels.max() + 1 if labels.size else 0, dtype=bool)
+    redrawn[labels[changed]] = True
+    return fill_holes(redrawn[labels], diagonals)
+
+
+def residual_levels(packed, factors, diagonals=False):
+    # Yields (factor, level pixels, skip color) from the coarsest factor to the
+    # finest. The first level holds every pixel of the downsampled image, later
+    # levels only the patches that differ from what the coarser levels drew, the
+    # other pixels are set to the skip color.
+    skip = unused_color(packed)
+    previous = None
+    previous_factor = None
+    for factor in factors:
+        level = downsample(packed, factor)
+        if previous is None:
+            residual = level
+        else:
+            drawn = upsample(previous, previous_factor // factor, *level.shape)
+            residual = np.where(changed_patches(level, level != drawn, diagonals), level, skip)
+        yield factor, residual, skip
+        previous = level
+        previous_factor = factor
+
+
+def scale_points(points, factor, offset, width, height):
+    # (N, 2) points or (N, 4) bounds from level pixels to image pixels, with the
+    # y axis pointing up. Blocks on the right and bottom edges of the image are
+    # only partly inside it and get cut at its border.
+    points = np.asarray(points)
+    scaled = points.reshape(-1, 2) * factor + (0, offset)
+    return np.clip(scaled, 0, (width, height)).reshape(points.shape)
@@ -1,162 +1,472 @@
-from PIL import Image
-from functools import cmp_to_key
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import argparse
+import collections
+import contextlib
+import functools
+import io
+import itertools
+import os
+import time
+import numpy as np
 import interface
+import labeling
+import layering
+import levels
+import profiling
+import quantize
+import rectangles
+import simplify
+import tiling
 
 
 # --- INITIALIZING VARIABLES AND FUNCTIONS --- #
-im = Image.open("Image Rendering/suki_25.png")
-
-width = im.width
-height = im.height
-print("Width: " + str(width) + ", Height: " + str(height))
-
-f = open("../randompy/desmos_output.txt", "w")
-
-neighbors_all = {(x, y) for x in range(-1, 2) for y in range(-1, 2) if x != 0 or y != 0}
-neighbors_adjacent = {(x, y) for x in range(-1, 2) for y in range(-1, 2) if (x == 0) != (y == 0)}
-
-
-def add_tuple(a, b):
-    to_return = (a[0] + b[0], a[1] + b[1])
-    return to_return
-
-
-def flood_fill(point, colors, diagonals=False):
-    found_points = set()
-    queue = [point]
-    found_points.add(point)
-    while len(queue) > 0:
-        point = queue.pop(0)
-        neighbors = neighbors_all if diagonals else neighbors_adjacent
-        next_points = {add_tuple(point, n) for n in neighbors}
-        for p in next_points:
-            if p[0] < 0 or p[0] >= width:
-                continue
-            if p[1] < 0 or p[1] >= height:
-                continue
-            if im.getpixel(p) in colors:
-                if p not in found_points:
-                    queue.append(p)
-                    found_points.add(p)
-
-    return found_points
-
-
-def get_neighboring_points(point, diagonals=False):
-    neighbors = neighbors_all if diagonals else neighbors_adjacent
-    return {add_tuple(point, n) for n in neighbors}
-
-
-def next_point(point, edge_points, edge, right=True):
-    rotate_dir = not right
-    working_point = point
-    move_dir = rotate(edge, rotate_dir)
-
-    if add_tuple(add_tuple(working_point, move_dir), edge) in edge_points:
-        return_tuple = (rotate(edge, not rotate_dir), add_tuple(add_tuple(working_point, move_dir), edge))
-    elif add_tuple(working_point, move_dir) in edge_points:
-        return_tuple = (edge, add_tuple(working_point, move_dir))
+engines = ["contours", "rectangles", "auto"]
+
+EngineReport = collections.namedtuple(
+    "EngineReport", ["engine", "contour_bytes", "contour_vertices", "rectangle_bytes", "rectangle_vertices"])
+
+LevelReport = collections.namedtuple("LevelReport", ["level", "factor", "width", "height", "pixels", "expressions",
+                                                     "bytes"])
+
+default_options = {
+    # The palette is reduced to palette_colors colors, or to as many as fit in
+    # max_expressions expressions of the chosen engine, grouping and levels,
+    # before the image is split into patches. None keeps every color of the image.
+    "palette_colors": None,
+    "max_expressions": None,
+    "quantize_method": "median-cut",
+    "dither": False,
+    # Boundaries are always reduced to their corners, a tolerance above 0 (in
+    # pixels) additionally simplifies them with one of simplify.simplify_methods
+    "simplify_tolerance": 0,
+    "simplify_method": "douglas-peucker",
+    "diagonals": False,
+    # Polygons of one color are emitted as a single list expression per
+    # painter's order layer instead of one expression each
+    "group_colors": False,
+    # Colors used by several expressions are defined once as variables in a
+    # hidden folder and referenced by name
+    "intern_styles": False,
+    # "contours" traces every patch as a polygon, "rectangles" splits the image
+    # into same colored rectangles and "auto" keeps whichever is smaller
+    "engine": "contours",
+    # With more than one level the image is drawn coarse first, downsampled by
+    # level_ratio once per level, and every finer level only redraws the
+    # patches that differ from the coarser ones
+    "levels": 1,
+    "level_ratio": 4,
+    # Labeling and tracing are split into this many bands on a process pool
+    "tiles": 1,
+    "verbose": False,
+}
+
+
+def sort_boundaries(ordered_boundaries):
+    # Largest bounding boxes first, so smaller patches are drawn over them. The
+    # boxes are computed once for all boundaries instead of per comparison.
+    order = layering.painter_order(layering.polygon_bboxes([n[1] for n in ordered_boundaries]))
+    return [ordered_boundaries[n] for n in order.tolist()]
+
+
+def polygon_bytes(polygons):
+    return sum(len(interface.escape_js_string(interface.polygon_latex(n))) for n in polygons)
+
+
+def band_pool(options, executor=None):
+    # The pool the bands of every level run on, created once per conversion
+    # unless the caller shares one across images
+    if options["tiles"] > 1 and executor is None:
+        return ProcessPoolExecutor(max_workers=options["tiles"])
+    return contextlib.nullcontext(executor)
+
+
+def contour_groups(pixels, options, executor=None):
+    # Traced patch boundaries as (color, "polygons", [points, ...]) in drawing order
+    height = pixels.shape[0]
+
+    # --- FIND PATCHES OF THE SAME COLOR AND TRACE THEIR BOUNDARIES --- #
+    if options["tiles"] > 1:
+        with band_pool(options, executor) as executor:
+            label_result, patch_contours = tiling.label_and_trace(pixels, options["diagonals"], options["tiles"], executor)
     else:
-        return_tuple = (rotate(edge, rotate_dir), working_point)
-
-    return return_tuple
-
-
-def rotate(point, left=True):
-    if left:
-        return_tuple = (-point[1], point[0])
+        label_result, patch_contours = tiling.label_and_trace(pixels, options["diagonals"])
+    patch_colors = [tuple(n) for n in labeling.unpack_colors(label_result.colors).tolist()]
+    profiling.count("patches", len(patch_colors))
+
+    traced_boundaries = [patch[0] * (1, -1) + (0, height) for patch in patch_contours]
+
+    # --- SIMPLIFY BOUNDARIES --- #
+    with profiling.stage("simplify"):
+        simplified_boundaries, simplify_stats = simplify.simplify_polygons(
+            traced_boundaries, options["simplify_tolerance"], options["simplify_method"])
+    profiling.count("vertices traced", simplify_stats.vertices_before)
+    profiling.count("vertices", simplify_stats.vertices_after)
+    if options["verbose"]:
+        print("Vertices: " + str(simplify_stats.vertices_before) + " -> " + str(simplify_stats.vertices_after)
+              + ", polygon bytes: " + str(polygon_bytes(traced_boundaries))
+              + " -> " + str(polygon_bytes(simplified_boundaries)))
+
+    ordered_boundaries = []
+    for label, (color, boundary) in enumerate(zip(patch_colors, simplified_boundaries)):
+        ordered_boundaries.append((color, boundary, label))
+
+    with profiling.stage("sort"):
+        ordered_boundaries = sort_boundaries(ordered_boundaries)
+
+    if options["group_colors"]:
+        with profiling.stage("layering"):
+            color_ids = {}
+            colors = [color_ids.setdefault(n[0], len(color_ids)) for n in ordered_boundaries]
+            if options["simplify_tolerance"] <= 0:
+                # Traced outlines only overlap where one patch encloses another
+                parents = layering.enclosing_labels(label_result.labels, patch_contours)
+                label_layers = layering.containment_layers(parents, [color_ids[n] for n in patch_colors])
+                layers = label_layers[[n[2] for n in ordered_boundaries]]
+            else:
+                # Simplified outlines can spill over their neighbors
+                layers = layering.assign_layers(layering.polygon_bboxes([n[1] for n in ordered_boundaries]), colors)
+            groups = layering.group_by_layer(ordered_boundaries, colors, layers)
+            polygon_groups = [(n[0][0], [j[1] for j in n]) for (_, n) in groups]
     else:
-        return_tuple = (point[1], -point[0])
-    return return_tuple
-
-
-def get_bounding_box_area(set_of_points):
-    x = [n[0] for n in set_of_points]
-    y = [n[1] for n in set_of_points]
-
-    return (max(y) - min(y)) * (max(x) - min(x))
-
-
-def compare(set1, set2):
-    return get_bounding_box_area(set1[1]) - get_bounding_box_area(set2[1])
-
-
-# --- FIND PATCHES OF THE SAME COLOR --- #
-unseen_points = set()
-image_colors = set()
-for x in range(width):
-    for y in range(height):
-        unseen_points.add((x, y))
-        image_colors.add(im.getpixel((x, y)))
-
-patch_points = []
-while len(unseen_points) > 0:
-    curr_point = unseen_points.pop()
-    curr_color = im.getpixel(curr_point)
-    same_color_points = flood_fill(curr_point, {curr_color})
-    patch_points.append((curr_color, same_color_points))
-    unseen_points.difference_update(same_color_points)
-
-
-# --- TRACE BOUNDARIES OF PATCHES --- #
-boundary_points = []
-for patch in patch_points:
-    boundary = {n for n in patch[1] if len([j for j in get_neighboring_points(n) if j not in patch[1]]) > 0}
-    boundary_points.append((patch[0], boundary))
-
-move_right = True
-ordered_boundaries = []
-for boundary in boundary_points:
-    points = list(boundary[1])
-    max_y_index = -1
-    max_y = -1
-    for i in range(len(points)):
-        if points[i][1] > max_y:
-            max_y_index = i
-            max_y = points[i][1]
-
-    starting_point = ((0, 1), points[max_y_index])
-
-    curr_point = starting_point
-    boundary_ordered = [curr_point]
-    while next_point(curr_point[1], boundary[1], curr_point[0], True) != starting_point:
-        curr_point = next_point(curr_point[1], boundary[1], curr_point[0], True)
-        boundary_ordered.append(curr_point)
-
-    boundary_ordered = [n if n[0] != (0, 1) else (n[0], (n[1][0], n[1][1] + 1)) for n in boundary_ordered]
-    boundary_ordered = [n if n[0] != (1, 0) else (n[0], (n[1][0] + 1, n[1][1] + 1)) for n in boundary_ordered]
-    boundary_ordered = [n if n[0] != (0, -1) else (n[0], (n[1][0] + 1, n[1][1])) for n in boundary_ordered]
-
-    ordered_boundaries.append((boundary[0], [n[1] for n in boundary_ordered]))
-
-
-ordered_boundaries = sorted(ordered_boundaries, key=cmp_to_key(compare), reverse=True)
-ordered_boundaries = [(n[0], [(j[0], height - j[1]) for j in n[1]]) for n in ordered_boundaries]
-
-text = interface.Text()
-text.set_text("The below folder contains ~3MB of image data and may lag your computer if opened")
-
-folder = interface.Folder()
-folder.set_collapsed(True)
-folder.set_title("Image Data")
-
-for i in ordered_boundaries:
-    latex = "polygon("
-    latex += str([n for n in i[1]])
-    latex += ")"
-
-    color = "rgb" + str(i[0][:3])
-
-    expression = interface.Expression()
-    expression.set_latex(latex)
-    expression.set_color_latex(color)
-    expression.set_line_width(1)
-    expression.set_fill_opacity(1)
-
-    folder.add_expression(expression)
-
-graph = interface.Graph()
-graph.reset_expressions()
-graph.append(text)
-graph.append(folder)
-graph.generate_output("Image Rendering/output.txt")
+        polygon_groups = [(n[0], [n[1]]) for n in ordered_boundaries]
+    profiling.count("polygons", len(ordered_boundaries))
+    if options["verbose"]:
+        print("Contour expressions: " + str(len(polygon_groups)) + " for " + str(len(ordered_boundaries))
+              + " polygons")
+    return [(color, "polygons", polygons) for (color, polygons) in polygon_groups]
+
+
+def rectangle_groups(pixels):
+    # Same colored rectangles as (color, "rectangles", bounds), one group per
+    # color. The rectangles never overlap, so the drawing order does not matter.
+    height = pixels.shape[0]
+    with profiling.stage("rectangles"):
+        bounds, colors = rectangles.find_rectangles(pixels)
+        groups = rectangles.group_by_color(bounds, colors)
+    profiling.count("rectangles", len(bounds))
+
+    result = []
+    for packed, group in groups:
+        color = tuple(labeling.unpack_colors([packed])[0].tolist())
+        # Rows grow downwards in the image and upwards in the graph
+        flipped = np.stack([group[:, 0], height - group[:, 3], group[:, 2], height - group[:, 1]], axis=1)
+        result.append((color, "rectangles", flipped))
+    return result
+
+
+def shape_column(group):
+    # The ExpressionBatch column that draws a group's shapes
+    _, kind, shapes = group
+    if kind == "rectangles":
+        return "rectangles"
+    return "polygon" if len(shapes) == 1 else "polygons"
+
+
+def build_expressions(groups):
+    # One ExpressionBatch row per group. The rows are measured before they are
+    # written, so they are serialized once and kept.
+    expressions = interface.ExpressionBatch(cache_rows=True)
+    with profiling.stage("build graph"):
+        for column, run in itertools.groupby(groups, key=shape_column):
+            run = list(run)
+            shapes = [n[2] if column != "polygon" else n[2][0] for n in run]
+            expressions.extend(**{column: shapes}, color_latex=["rgb" + str(n[0][:3]) for n in run],
+                               line_width=1, fill_opacity=1)
+    return expressions
+
+
+def expression_bytes(expressions):
+    return sum(len(n) for n in expressions.iter_strings())
+
+
+def group_vertices(groups):
+    return sum(4 * len(shapes) if kind == "rectangles" else sum(len(n) for n in shapes)
+               for (_, kind, shapes) in groups)
+
+
+def count_expressions(pixels, options, executor=None):
+    # Expressions the options make of quantized pixels, the unit of max_expressions
+    options = dict(options, verbose=False)
+    if options["levels"] > 1:
+        return sum(len(expressions) for (expressions, _) in build_levels(pixels, options, executor))
+    return len(build_shapes(pixels, options, executor=executor)[0])
+
+
+def prepare_pixels(image, options, executor=None):
+    with profiling.stage("read image"):
+        pixels = labeling.unpack_colors(labeling.read_pixels(labeling.open_image(image)))
+    height, width = pixels.shape[:2]
+    profiling.count("pixels", width * height)
+    if options["verbose"]:
+        print("Width: " + str(width) + ", Height: " + str(height))
+
+    # --- REDUCE THE PALETTE --- #
+    with profiling.stage("quantize"):
+        counter = None
+        if options["engine"] != "contours" or options["group_colors"] or options["levels"] > 1:
+            # Only ungrouped contours of a single level make one expression per patch
+            counter = functools.partial(count_expressions, options=options, executor=executor)
+        return quantize.quantize(pixels, options["palette_colors"], options["max_expressions"],
+                                 options["quantize_method"], options["dither"], options["diagonals"], counter)
+
+
+def pack_color(color):
+    return int(labeling.pack_colors(np.array([[color]], dtype=np.uint8))[0, 0])
+
+
+def level_groups(groups, skip_color=None, scale=None):
+    # Drops the shapes of the packed skip_color, which marks the pixels a level
+    # leaves out, and moves the rest from level pixels to image pixels. scale is
+    # (factor, level height, width, height).
+    if skip_color is not None:
+        groups = [n for n in groups if pack_color(n[0]) != skip_color]
+    if scale is None or scale[0] == 1:
+        return groups
+    factor, level_height, width, height = scale
+    offset = height - level_height * factor
+    return [(color, kind, levels.scale_points(shapes, factor, offset, width, height) if kind == "rectangles"
+             else [levels.scale_points(n, factor, offset, width, height) for n in shapes])
+            for (color, kind, shapes) in groups]
+
+
+def build_shapes(pixels, options, skip_color=None, scale=None, executor=None):
+    # Returns the expressions of the chosen engine and an EngineReport of the
+    # bytes and vertices of every engine that ran. Patches of the packed
+    # skip_color are left out and scale moves the shapes of a downsampled
+    # level, see level_groups.
+    if options["engine"] not in engines:
+        raise ValueError("Unknown engine: " + options["engine"])
+    report = {"engine": options["engine"]}
+    if options["engine"] in ("contours", "auto"):
+        groups = level_groups(contour_groups(pixels, options, executor), skip_color, scale)
+        contour_expressions = build_expressions(groups)
+        report["contour_bytes"] = expression_bytes(contour_expressions)
+        report["contour_vertices"] = group_vertices(groups)
+        expressions = contour_expressions
+    if options["engine"] in ("rectangles", "auto"):
+        groups = level_groups(rectangle_groups(pixels), skip_color, scale)
+        rectangle_expressions = build_expressions(groups)
+        report["rectangle_bytes"] = expression_bytes(rectangle_expressions)
+        report["rectangle_vertices"] = group_vertices(groups)
+        expressions = rectangle_expressions
+    if options["engine"] == "auto":
+        # The engine whose expressions serialize smaller wins
+        if report["contour_bytes"] <= report["rectangle_bytes"]:
+            report["engine"] = "contours"
+            expressions = contour_expressions
+        else:
+            report["engine"] = "rectangles"
+    report = EngineReport(**dict(dict.fromkeys(EngineReport._fields), **report))
+
+    profiling.count("expressions", len(expressions))
+    if options["verbose"]:
+        print("Engine: " + report.engine + ", expressions: " + str(len(expressions))
+              + ", contours: " + str(report.contour_bytes) + " bytes / " + str(report.contour_vertices) + " vertices"
+              + ", rectangles: " + str(report.rectangle_bytes) + " bytes / " + str(report.rectangle_vertices)
+              + " vertices")
+    return expressions, report
+
+
+def scale_name(factor):
+    return "full scale" if factor == 1 else "1/" + str(factor) + " scale"
+
+
+def build_levels(pixels, options, executor=None):
+    # Returns (expressions, LevelReport) per level, coarsest first
+    height, width = pixels.shape[:2]
+    if options["levels"] < 1 or options["level_ratio"] < 2:
+        raise ValueError("levels must be at least 1 and level_ratio at least 2")
+    factors = levels.level_factors(options["levels"], options["level_ratio"])
+    result = []
+    with profiling.stage("levels"):
+        residuals = list(levels.residual_levels(labeling.pack_colors(pixels), factors, options["diagonals"]))
+    for number, (factor, residual, skip) in enumerate(residuals, 1):
+        skip_color = int(skip) if number > 1 else None
+        expressions, _ = build_shapes(labeling.unpack_colors(residual), options, skip_color,
+                                      (factor, residual.shape[0], width, height), executor)
+        report = LevelReport(number, factor, residual.shape[1], residual.shape[0],
+                             int(np.count_nonzero(residual != skip)), len(expressions), expression_bytes(expressions))
+        profiling.count("level " + str(number) + " bytes", report.bytes)
+        if options["verbose"]:
+            print("Level " + str(number) + " (" + scale_name(factor) + "): " + str(report.pixels) + " pixels, "
+                  + str(report.expressions) + " expressions, " + str(report.bytes) + " bytes")
+        result.append((expressions, report))
+    return result
+
+
+def _options(options):
+    unknown = set(options) - set(default_options)
+    if unknown:
+        raise TypeError("Unknown image_to_graph options: " + ", ".join(sorted(unknown)))
+    return dict(default_options, **options)
+
+
+def compare_engines(image, **options):
+    # Runs every engine on the image and returns their EngineReport
+    options = _options(dict(options, engine="auto"))
+    return build_shapes(prepare_pixels(image, options), options)[1]
+
+
+def report_levels(image, **options):
+    # Returns the LevelReport of every level the options produce
+    options = _options(options)
+    return [report for (_, report) in build_levels(prepare_pixels(image, options), options)]
+
+
+def image_to_graph(image, executor=None, **options):
+    # executor is a pool for the bands of tiles > 1 to share across images
+    options = _options(options)
+
+    with band_pool(options, executor) as executor:
+        pixels = prepare_pixels(image, options, executor)
+
+        # --- SPLIT THE IMAGE INTO SHAPES --- #
+        if options["levels"] > 1:
+            image_levels = build_levels(pixels, options, executor)
+        else:
+            image_levels = [(build_shapes(pixels, options, executor=executor)[0], None)]
+
+    # --- BUILD THE GRAPH --- #
+    text = interface.Text()
+    text.set_text("The below folder contains ~3MB of image data and may lag your computer if opened")
+
+    graph = interface.Graph()
+    graph.reset_expressions()
+    graph.append(text)
+
+    # Desmos draws later folders over earlier ones, so every level refines the one before
+    for expressions, report in image_levels:
+        folder = interface.Folder()
+        folder.set_collapsed(True)
+        if report is None:
+            folder.set_title("Image Data")
+        else:
+            folder.set_title("Image Data, level " + str(report.level) + " (" + scale_name(report.factor) + ")")
+        folder.add_expression(expressions)
+        graph.append(folder)
+
+    if options["intern_styles"]:
+        with profiling.stage("intern styles"):
+            intern_stats = graph.intern_styles()
+        if options["verbose"]:
+            print("Style variables: " + str(intern_stats.variables) + ", bytes: " + str(intern_stats.bytes_before)
+                  + " -> " + str(intern_stats.bytes_after))
+    return graph
+
+
+def convert_file(input_path, output_path, output_format="js", max_shard_bytes=None, max_shard_expressions=None,
+                 profile=False, executor=None, **options):
+    # With profile, the stage timings and counters are written next to the
+    # output as <name>.profile.json. The verbose reports of an image are
+    # printed together, so images converted in parallel do not mix them.
+    start = time.perf_counter()
+    report = io.StringIO()
+    with contextlib.redirect_stdout(report) if options.get("verbose") else contextlib.nullcontext():
+        with profiling.Profiler(track_memory=True) if profile else contextlib.nullcontext() as profiler:
+            graph = image_to_graph(input_path, executor, **options)
+            graph.generate_output(output_path, output_format=output_format, max_bytes=max_shard_bytes,
+                                  max_expressions=max_shard_expressions)
+    if report.getvalue():
+        print(str(input_path) + ":\n" + report.getvalue(), end="", flush=True)
+    if profile:
+        profiler.to_json(os.path.splitext(output_path)[0] + ".profile.json")
+    return input_path, output_path, time.perf_counter() - start
+
+
+def output_path_for(input_path, output_dir=None, output_format="js"):
+    extension = ".json" if output_format == "json" else ".txt"
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(output_dir if output_dir is not None else os.path.dirname(input_path), stem + extension)
+
+
+def output_paths_for(input_paths, output_dir=None, output_format="js"):
+    # Outputs are named after the input's stem only, so a.png and a.ppm, or
+    # files of one name in different directories with an output_dir, would
+    # write the same script, shards and profile from parallel workers
+    outputs = [output_path_for(n, output_dir, output_format) for n in input_paths]
+    inputs = collections.defaultdict(list)
+    for input_path, output_path in zip(input_paths, outputs):
+        inputs[os.path.normcase(os.path.abspath(output_path))].append(input_path)
+    collisions = [n for n in inputs.values() if len(n) > 1]
+    if collisions:
+        raise ValueError("Images would share an output file: "
+                         + "; ".join(", ".join(n) for n in collisions))
+    return outputs
+
+
+def parse_arguments(arguments=None):
+    parser = argparse.ArgumentParser(description="Convert images into Desmos polygon graphs")
+    parser.add_argument("images", nargs="+", help="image files to convert")
+    parser.add_argument("-o", "--output-dir", help="directory for the outputs, defaults to next to each image")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--format", dest="output_format", choices=["js", "json"], default="js")
+    parser.add_argument("--max-shard-bytes", type=int,
+                        help="split the script into numbered files of at most this many bytes, with a manifest")
+    parser.add_argument("--max-shard-expressions", type=int,
+                        help="split the script into numbered files of at most this many expressions")
+    parser.add_argument("--colors", dest="palette_colors", type=int, help="reduce the palette to this many colors")
+    parser.add_argument("--max-expressions", type=int, help="reduce the palette until the graph fits this many expressions")
+    parser.add_argument("--quantize-method", choices=quantize.quantize_methods, default=default_options["quantize_method"])
+    parser.add_argument("--dither", action="store_true", help="use ordered dithering when reducing the palette")
+    parser.add_argument("--tolerance", dest="simplify_tolerance", type=float, default=0,
+                        help="boundary simplification tolerance in pixels")
+    parser.add_argument("--simplify-method", choices=simplify.simplify_methods, default=default_options["simplify_method"])
+    parser.add_argument("--diagonals", action="store_true", help="join same colored pixels that only touch diagonally")
+    parser.add_argument("--group-colors", action="store_true",
+                        help="emit polygons of one color as a single list expression per layer")
+    parser.add_argument("--intern-styles", action="store_true",
+                        help="define repeated colors once as variables in a hidden folder")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="print vertex, byte and expression counts of every stage, engine and level")
+    parser.add_argument("--profile", action="store_true",
+                        help="write stage timings, counters and peak memory to <name>.profile.json")
+    parser.add_argument("--engine", choices=engines, default=default_options["engine"],
+                        help="trace patch contours, split into rectangles or keep the smaller output")
+    parser.add_argument("--levels", type=int, default=1,
+                        help="draw the image coarse first and refine it over this many levels of detail")
+    parser.add_argument("--level-ratio", type=int, default=default_options["level_ratio"],
+                        help="downsampling factor between one level and the next")
+    parser.add_argument("--tiles", type=int, default=1, help="split labeling and tracing of each image across processes, converting the images one at a time")
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None):
+    arguments = vars(parse_arguments(arguments))
+    images = arguments.pop("images")
+    output_dir = arguments.pop("output_dir")
+    jobs = arguments.pop("jobs")
+    try:
+        outputs = output_paths_for(images, output_dir, arguments["output_format"])
+    except ValueError as e:
+        print(e)
+        return 2
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    if arguments["tiles"] > 1:
+        # Images are converted one at a time, sharing a single pool for their
+        # bands instead of nesting a pool in every worker
+        band_executor = ProcessPoolExecutor(max_workers=arguments["tiles"])
+        executor = ThreadPoolExecutor(max_workers=1)
+        arguments["executor"] = band_executor
+    else:
+        band_executor = contextlib.nullcontext()
+        executor = ProcessPoolExecutor(max_workers=max(1, min(jobs, len(images))))
+    with band_executor, executor:
+        futures = {executor.submit(convert_file, n, output, **arguments): n for (n, output) in zip(images, outputs)}
+        failed = 0
+        for future in as_completed(futures):
+            try:
+                input_path, output_path, seconds = future.result()
+                print("{}: {:.2f}s -> {}".format(input_path, seconds, output_path))
+            except Exception as e:
+                failed += 1
+                print("{}: failed, {}".format(futures[future], e))
+
+    print("Converted {} of {} images in {:.2f}s".format(len(images) - failed, len(images), time.perf_counter() - start))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,149 @@
+import json
+import time
+import tracemalloc
+
+
+# The profiler that stage() and count() report to, None when profiling is off
+_active = None
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_stage = _NullStage()
+
+
+class _Stage:
+    __slots__ = ("profiler", "name", "start", "peak")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = None
+        self.peak = 0
+
+    def __enter__(self):
+        if self.profiler.track_memory:
+            # Resetting the peak would hide it from the enclosing stages, so
+            # they take it over first
+            self.profiler.update_peaks()
+            tracemalloc.reset_peak()
+        self.profiler.open_stages.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        peak = None
+        if self.profiler.track_memory:
+            self.profiler.update_peaks()
+            peak = self.peak
+        self.profiler.open_stages.remove(self)
+        self.profiler.add_stage(self.name, seconds, peak)
+        return False
+
+
+def stage(name):
+    # Times the block as the named stage of the active profiler, costs one
+    # global lookup when profiling is off
+    if _active is None:
+        return _null_stage
+    return _Stage(_active, name)
+
+
+def count(name, value=1):
+    if _active is not None:
+        _active.counters[name] = _active.counters.get(name, 0) + value
+
+
+class Profiler:
+    # Collects stage timings and counters while it is active:
+    #
+    #     with profiling.Profiler() as profiler:
+    #         polygon_image.image_to_graph(image).generate_output(path)
+    #     print(profiler.summary())
+    #
+    # callback(name, seconds, peak_memory) is called as each stage ends. Peak
+    # memory uses tracemalloc, which slows Python allocations down noticeably,
+    # so it is only sampled with track_memory.
+    def __init__(self, callback=None, track_memory=False):
+        self.callback = callback
+        self.track_memory = track_memory
+        self.stages = {}
+        self.counters = {}
+        self.open_stages = []
+        self.__previous = None
+        self.__clean_latex = None
+        self.__started_tracing = False
+
+    def __enter__(self):
+        global _active
+        self.__previous = _active
+        _active = self
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.__started_tracing = True
+
+        # clean_latex is wrapped only while profiling so the unprofiled path
+        # keeps no counting overhead at all
+        import interface
+        self.__clean_latex = interface.clean_latex
+        clean_latex = self.__clean_latex
+        counters = self.counters
+
+        def counted_clean_latex(latex):
+            counters["clean_latex calls"] = counters.get("clean_latex calls", 0) + 1
+            counters["clean_latex input bytes"] = counters.get("clean_latex input bytes", 0) + len(latex)
+            return clean_latex(latex)
+
+        interface.clean_latex = counted_clean_latex
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        import interface
+        interface.clean_latex = self.__clean_latex
+        if self.__started_tracing:
+            tracemalloc.stop()
+            self.__started_tracing = False
+        _active = self.__previous
+        return False
+
+    def update_peaks(self):
+        peak = tracemalloc.get_traced_memory()[1]
+        for open_stage in self.open_stages:
+            open_stage.peak = max(open_stage.peak, peak)
+
+    def add_stage(self, name, seconds, peak_memory=None):
+        record = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "peak_memory": None})
+        record["calls"] += 1
+        record["seconds"] += seconds
+        if peak_memory is not None:
+            record["peak_memory"] = max(record["peak_memory"] or 0, peak_memory)
+        if self.callback is not None:
+            self.callback(name, seconds, peak_memory)
+
+    def report(self):
+        return {"stages": self.stages, "counters": self.counters}
+
+    def to_json(self, output=None):
+        if output is None:
+            return json.dumps(self.report(), indent=2)
+        with open(output, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def summary(self):
+        lines = ["{:<24} {:>6} {:>12} {:>12}".format("stage", "calls", "seconds", "peak MB")]
+        for name, record in self.stages.items():
+            peak = "-" if record["peak_memory"] is None else "{:.1f}".format(record["peak_memory"] / 2 ** 20)
+            lines.append("{:<24} {:>6} {:>12.3f} {:>12}".format(name, record["calls"], record["seconds"], peak))
+        for name, value in self.counters.items():
+            lines.append("{:<24} {:>12}".format(name, value))
+        return "\n".join(lines)
@@ -0,0 +1,156 @@
+import heapq
+import itertools
+
+import numpy as np
+
+import labeling
+
+
+quantize_methods = ["median-cut", "k-means"]
+
+bayer_matrix = np.array([
+    [0, 8, 2, 10],
+    [12, 4, 14, 6],
+    [3, 11, 1, 9],
+    [15, 7, 13, 5],
+]) / 16 - 0.5
+
+# Rows of colors compared against the palette at once, bounds the distance matrix
+CHUNK_SIZE = 1 << 16
+
+
+def unique_colors(pixels):
+    packed = labeling.pack_colors(pixels)
+    colors, inverse, counts = np.unique(packed.ravel(), return_inverse=True, return_counts=True)
+    return labeling.unpack_colors(colors).astype(np.float64), inverse.reshape(packed.shape), counts
+
+
+def median_cut(colors, counts, n_colors):
+    # Splits the box with the widest channel at the population weighted median
+    # until there are n_colors boxes, the palette is the weighted mean of each box.
+    # Boxes that can still be split wait in a heap keyed by their widest channel,
+    # ties go to the older box.
+    if len(colors) == 0:
+        return np.zeros((0, colors.shape[1]))
+    done = []
+    heap = []
+    created = itertools.count()
+
+    def push(box):
+        if len(box) > 1:
+            widths = np.ptp(colors[box], axis=0)
+            heapq.heappush(heap, (-widths.max(), next(created), int(np.argmax(widths)), box))
+        else:
+            done.append(box)
+
+    push(np.arange(len(colors)))
+    while heap and len(heap) + len(done) < n_colors:
+        _, _, channel, box = heapq.heappop(heap)
+        box = box[np.argsort(colors[box, channel], kind="stable")]
+        population = np.cumsum(counts[box])
+        split = int(np.searchsorted(population, population[-1] / 2))
+        split = min(max(split, 1), len(box) - 1)
+        push(box[:split])
+        push(box[split:])
+
+    boxes = done + [n[3] for n in heap]
+    box_ids = np.repeat(np.arange(len(boxes)), [len(n) for n in boxes])
+    members = np.concatenate(boxes)
+    weights = np.bincount(box_ids, weights=counts[members], minlength=len(boxes))
+    sums = np.stack([np.bincount(box_ids, weights=counts[members] * colors[members, n], minlength=len(boxes))
+                     for n in range(colors.shape[1])], axis=1)
+    return sums / weights[:, None]
+
+
+def nearest_colors(colors, palette):
+    nearest = np.empty(len(colors), dtype=np.int64)
+    palette_norms = (palette ** 2).sum(axis=1)
+    for start in range(0, len(colors), CHUNK_SIZE):
+        chunk = colors[start:start + CHUNK_SIZE]
+        distances = palette_norms[None, :] - 2 * chunk @ palette.T
+        nearest[start:start + CHUNK_SIZE] = np.argmin(distances, axis=1)
+    return nearest
+
+
+def k_means(colors, counts, n_colors, iterations=16):
+    # Lloyd iterations over the distinct colors weighted by their pixel counts,
+    # seeded with the median cut palette so results are deterministic
+    palette = median_cut(colors, counts, n_colors)
+    for _ in range(iterations):
+        nearest = nearest_colors(colors, palette)
+        weights = np.bincount(nearest, weights=counts, minlength=len(palette))
+        sums = np.stack([np.bincount(nearest, weights=counts * colors[:, n], minlength=len(palette))
+                         for n in range(colors.shape[1])], axis=1)
+        used = weights > 0
+        updated = palette.copy()
+        updated[used] = sums[used] / weights[used, None]
+        if np.allclose(updated, palette):
+            break
+        palette = updated
+    return palette
+
+
+def _rgba_array(image):
+    return labeling.unpack_colors(labeling.pack_colors(labeling.image_to_array(image)))
+
+
+def _palette(colors, counts, n_colors, method):
+    if method not in quantize_methods:
+        raise ValueError("Unknown quantization method: " + method)
+    if method == "median-cut":
+        return median_cut(colors, counts, n_colors)
+    return k_means(colors, counts, n_colors)
+
+
+def build_palette(image, n_colors, method="median-cut"):
+    colors, _, counts = unique_colors(_rgba_array(image))
+    return _palette(colors, counts, n_colors, method)
+
+
+def apply_palette(image, palette, dither=False):
+    pixels = _rgba_array(image)
+    rounded = np.clip(np.rint(palette), 0, 255).astype(np.uint8)
+    if not dither:
+        colors, inverse, _ = unique_colors(pixels)
+        return rounded[nearest_colors(colors, palette)][inverse]
+
+    # Ordered dithering offsets every pixel by a tiled Bayer threshold before
+    # picking its nearest palette color
+    height, width = pixels.shape[:2]
+    spread = 255 / max(len(palette) ** (1 / 3), 1)
+    thresholds = np.tile(bayer_matrix, (height // 4 + 1, width // 4 + 1))[:height, :width] * spread
+    shifted = pixels.astype(np.float64)
+    shifted[..., :3] += thresholds[..., None]
+    nearest = nearest_colors(shifted.reshape(-1, pixels.shape[2]), palette)
+    return rounded[nearest].reshape(pixels.shape)
+
+
+def quantize(image, n_colors=None, max_expressions=None, method="median-cut", dither=False, diagonals=False,
+             count_expressions=None):
+    # Reduces the palette to n_colors, or to the most colors for which the image
+    # still makes at most max_expressions expressions. count_expressions gives
+    # that number for quantized pixels, by default one expression per patch.
+    if count_expressions is None:
+        def count_expressions(candidate):
+            return len(labeling.label_image(candidate, diagonals).areas)
+    pixels = _rgba_array(image)
+    if n_colors is None and max_expressions is None:
+        return pixels
+
+    colors, _, counts = unique_colors(pixels)
+    if max_expressions is None:
+        return apply_palette(pixels, _palette(colors, counts, n_colors, method), dither)
+
+    # Every color makes at least one expression, so more colors than max_expressions never fit
+    low = 1
+    high = min(len(colors), max_expressions) if n_colors is None else min(n_colors, len(colors), max_expressions)
+    best = apply_palette(pixels, _palette(colors, counts, low, method), dither)
+    while low < high:
+        middle = (low + high + 1) // 2
+        candidate = apply_palette(pixels, _palette(colors, counts, middle, method), dither)
+        if count_expressions(candidate) <= max_expressions:
+            low = middle
+            best = candidate
+        else:
+            high = middle - 1
+    return best
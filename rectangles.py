@@ -0,0 +1,42 @@
+import numpy as np
+
+import interface
+import labeling
+
+
+def find_rectangles(packed):
+    # Splits the image into axis aligned rectangles of one color. Every row is
+    # cut into maximal runs, and runs with the same columns and color in
+    # consecutive rows are stacked into one rectangle. Returns (x0, y0, x1, y1)
+    # bounds with exclusive ends, in raster order of their top left corner, and
+    # the packed color of each.
+    packed = labeling.pack_colors(packed)
+    rows, x0, x1, colors = labeling.find_runs(packed)
+    if len(rows) == 0:
+        return np.zeros((0, 4), dtype=np.int64), np.zeros(0, dtype=np.uint32)
+
+    order = np.lexsort((rows, colors, x1, x0))
+    rows = rows[order]
+    x0 = x0[order]
+    x1 = x1[order]
+    colors = colors[order]
+
+    starts = np.ones(len(rows), dtype=bool)
+    starts[1:] = (x0[1:] != x0[:-1]) | (x1[1:] != x1[:-1]) | (colors[1:] != colors[:-1]) | (rows[1:] != rows[:-1] + 1)
+    first = np.flatnonzero(starts)
+    last = np.append(first[1:], len(rows)) - 1
+
+    bounds = np.stack([x0[first], rows[first], x1[first], rows[last] + 1], axis=1).astype(np.int64)
+    raster = np.lexsort((bounds[:, 0], bounds[:, 1]))
+    return bounds[raster], colors[first][raster]
+
+
+def group_by_color(bounds, colors, max_length=interface.MAX_LIST_LENGTH):
+    # Returns (packed color, bounds) per color in order of first appearance,
+    # colors with more than max_length rectangles are split over several groups
+    unique, first, inverse = np.unique(colors, return_index=True, return_inverse=True)
+    order = np.argsort(inverse, kind="stable")
+    split = np.cumsum(np.bincount(inverse, minlength=len(unique)))[:-1]
+    groups = np.split(bounds[order], split)
+    return [(unique[n], groups[n][start:start + max_length])
+            for n in np.argsort(first).tolist() for start in range(0, len(groups[n]), max_length)]
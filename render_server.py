@@ -0,0 +1,314 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+import argparse
+import collections
+import functools
+import io
+import json
+import os
+import shutil
+import socketserver
+import tempfile
+import threading
+import time
+
+import interface
+
+
+# Jobs waiting for or running on a worker, timed out ones included, more
+# requests are turned away with 503
+MAX_PENDING = 64
+
+# Seconds a request may take before it is answered with 504
+REQUEST_TIMEOUT = 120
+
+# Latencies kept for the percentiles in /stats
+LATENCY_WINDOW = 1024
+
+
+def _parse_bool(value):
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+# image_to_graph options a /convert request may set in its query string
+option_types = {
+    "palette_colors": int,
+    "max_expressions": int,
+    "quantize_method": str,
+    "dither": _parse_bool,
+    "simplify_tolerance": float,
+    "simplify_method": str,
+    "diagonals": _parse_bool,
+    "group_colors": _parse_bool,
+    "intern_styles": _parse_bool,
+    "engine": str,
+    "levels": int,
+    "level_ratio": int,
+}
+
+
+# --- WORKERS --- #
+def _warm_worker():
+    # Imports and a tiny conversion run once per process, so requests start with
+    # every module loaded and the latex caches filled
+    import numpy as np
+    import polygon_image
+
+    pixels = np.zeros((4, 4, 4), dtype=np.uint8)
+    pixels[:2, :2] = (255, 0, 0, 255)
+    polygon_image.image_to_graph(pixels).generate_output(io.StringIO())
+
+
+def _write_output(graph, output_format):
+    # Scripts are written to a temporary file as they are generated and the
+    # handler streams it from there, so no worker holds or pickles a whole one.
+    # Returns the path, which the caller removes.
+    fd, path = tempfile.mkstemp(prefix="render-", suffix="." + output_format)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            graph.generate_output(f, output_format=output_format)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def _convert(image_bytes, options, output_format):
+    from PIL import Image
+    import polygon_image
+
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        image.load()
+    except OSError as e:
+        raise ValueError("Body is not a readable image: " + str(e)) from None
+    return _write_output(polygon_image.image_to_graph(image, **options), output_format)
+
+
+def _build_graph(spec, output_format):
+    # spec is {"expressions": [{column: value, ...}, ...]} with ExpressionBatch columns
+    graph = interface.Graph()
+    graph.reset_expressions()
+    batch = interface.ExpressionBatch()
+    for row in spec.get("expressions", []):
+        batch.append(**row)
+    graph.append(batch)
+    return _write_output(graph, output_format)
+
+
+def _remove_output(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _discard_result(discard, future):
+    if not future.cancelled() and future.exception() is None:
+        discard(future.result())
+
+
+# --- DISPATCH --- #
+class Overloaded(Exception):
+    pass
+
+
+class Dispatcher:
+    def __init__(self, workers=None, max_pending=MAX_PENDING, timeout=REQUEST_TIMEOUT):
+        workers = workers or os.cpu_count()
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=_warm_worker)
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.__slots = threading.BoundedSemaphore(max_pending)
+        self.__lock = threading.Lock()
+        self.__latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.__counts = collections.Counter()
+        self.__pending = 0
+        self.__started = time.time()
+
+        # Starts every worker now instead of on the first requests
+        for future in [self.executor.submit(time.sleep, 0) for _ in range(workers)]:
+            future.result()
+
+    def run(self, function, *arguments, discard=None):
+        # Runs function on the pool and returns its result, raises Overloaded
+        # when max_pending requests are already in flight and TimeoutError when
+        # the result takes longer than timeout. A timed out job that already
+        # started keeps its worker until it finishes, so it keeps its slot until
+        # then too, and discard is called with the result nobody waited for.
+        if not self.__slots.acquire(blocking=False):
+            self.__count("rejected")
+            raise Overloaded()
+        start = time.perf_counter()
+        with self.__lock:
+            self.__pending += 1
+        try:
+            future = self.executor.submit(function, *arguments)
+        except BaseException:
+            self.__release()
+            raise
+        future.add_done_callback(self.__release)
+        try:
+            result = future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            if discard is not None:
+                future.add_done_callback(functools.partial(_discard_result, discard))
+            self.__count("timed out")
+            raise
+        except Exception:
+            self.__count("failed")
+            raise
+        finally:
+            with self.__lock:
+                self.__latencies.append(time.perf_counter() - start)
+        self.__count("completed")
+        return result
+
+    def __release(self, future=None):
+        with self.__lock:
+            self.__pending -= 1
+        self.__slots.release()
+
+    def __count(self, name):
+        with self.__lock:
+            self.__counts[name] += 1
+
+    def stats(self):
+        with self.__lock:
+            latencies = sorted(self.__latencies)
+            stats = {
+                "queue_depth": self.__pending,
+                "max_pending": self.max_pending,
+                "uptime": time.time() - self.__started,
+                "requests": dict(self.__counts),
+            }
+        stats["latency"] = {
+            name: latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] if latencies else None
+            for name, fraction in [("p50", 0.5), ("p90", 0.9), ("p99", 0.99)]
+        }
+        return stats
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+# --- HTTP --- #
+class RenderHandler(BaseHTTPRequestHandler):
+    # POST /convert?colors=...  with the image file as the body
+    # POST /graph               with a JSON graph spec as the body
+    # GET  /stats               queue depth, request counts and latency percentiles
+    # The output format is picked with ?format=js or ?format=json.
+    protocol_version = "HTTP/1.1"
+
+    def address_string(self):
+        # Unix socket peers have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def do_GET(self):
+        if urlsplit(self.path).path != "/stats":
+            return self.send_text(404, "Unknown path\n")
+        self.send_text(200, json.dumps(self.server.dispatcher.stats(), indent=2) + "\n", "application/json")
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        query = dict(parse_qsl(url.query))
+        output_format = query.pop("format", "js")
+        if output_format not in ("js", "json"):
+            return self.send_text(400, "Unknown format: " + output_format + "\n")
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        try:
+            if url.path == "/convert":
+                unknown = set(query) - set(option_types)
+                if unknown:
+                    return self.send_text(400, "Unknown options: " + ", ".join(sorted(unknown)) + "\n")
+                options = {k: option_types[k](v) for (k, v) in query.items()}
+                path = self.server.dispatcher.run(_convert, body, options, output_format, discard=_remove_output)
+            elif url.path == "/graph":
+                path = self.server.dispatcher.run(_build_graph, json.loads(body), output_format,
+                                                  discard=_remove_output)
+            else:
+                return self.send_text(404, "Unknown path\n")
+        except Overloaded:
+            return self.send_text(503, "Too many pending requests\n", headers={"Retry-After": "1"})
+        except TimeoutError:
+            return self.send_text(504, "Timed out after " + str(self.server.dispatcher.timeout) + "s\n")
+        except (ValueError, TypeError) as e:
+            return self.send_text(400, str(e) + "\n")
+        except Exception as e:
+            return self.send_text(500, type(e).__name__ + ": " + str(e) + "\n")
+
+        content_type = "application/json" if output_format == "json" else "text/javascript"
+        try:
+            self.send_file(200, path, content_type)
+        finally:
+            _remove_output(path)
+
+    def send_file(self, status, path, content_type):
+        with open(path, "rb") as f:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type + "; charset=utf-8")
+            self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile, interface.OUTPUT_BUFFER_SIZE)
+
+    def send_text(self, status, text, content_type="text/plain", headers=None):
+        data = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type + "; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        super().server_bind()
+
+
+def make_server(dispatcher, host="127.0.0.1", port=8765, unix_socket=None):
+    if unix_socket is not None:
+        server = UnixHTTPServer(unix_socket, RenderHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), RenderHandler)
+    server.dispatcher = dispatcher
+    return server
+
+
+def parse_arguments(arguments=None):
+    parser = argparse.ArgumentParser(description="Serve image conversions and graph builds from a warm process pool")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix-socket", help="listen on this Unix socket instead of TCP")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING,
+                        help="requests queued or running before new ones get 503")
+    parser.add_argument("--timeout", type=float, default=REQUEST_TIMEOUT, help="seconds before a request gets 504")
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None):
+    arguments = parse_arguments(arguments)
+    dispatcher = Dispatcher(arguments.workers, arguments.max_pending, arguments.timeout)
+    server = make_server(dispatcher, arguments.host, arguments.port, arguments.unix_socket)
+    print("Listening on " + (arguments.unix_socket or "http://{}:{}".format(arguments.host, arguments.port)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        dispatcher.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,160 @@
+import collections
+import heapq
+
+import numpy as np
+
+
+SimplifyStats = collections.namedtuple("SimplifyStats", ["polygons", "vertices_before", "vertices_after"])
+
+simplify_methods = ["douglas-peucker", "visvalingam"]
+
+
+def merge_collinear(points):
+    # Drops every vertex of a closed ring that lies on the straight line through
+    # its neighbors, the ring keeps exactly the same shape.
+    points = np.asarray(points)
+    if len(points) <= 3:
+        return points
+    incoming = points - np.roll(points, 1, axis=0)
+    outgoing = np.roll(points, -1, axis=0) - points
+    cross = incoming[:, 0] * outgoing[:, 1] - incoming[:, 1] * outgoing[:, 0]
+    corners = cross != 0
+    if np.count_nonzero(corners) < 3:
+        return points
+    return points[corners]
+
+
+def merge_collinear_rings(polygons):
+    # merge_collinear of every ring in one pass over all their points, which
+    # are concatenated and addressed by offsets like layering.polygon_bboxes
+    if len(polygons) == 0:
+        return []
+    sizes = np.array([len(n) for n in polygons])
+    points = np.concatenate(polygons)
+    starts = np.cumsum(sizes) - sizes
+    ring_starts = np.repeat(starts, sizes)
+    ring_sizes = np.repeat(sizes, sizes)
+    index = np.arange(len(points))
+    previous = ring_starts + (index - ring_starts - 1) % ring_sizes
+    following = ring_starts + (index - ring_starts + 1) % ring_sizes
+
+    incoming = points - points[previous]
+    outgoing = points[following] - points
+    corners = incoming[:, 0] * outgoing[:, 1] - incoming[:, 1] * outgoing[:, 0] != 0
+    # Rings that would keep fewer than 3 vertices, and triangles, stay whole
+    counts = np.add.reduceat(corners, starts)
+    whole = (sizes <= 3) | (counts < 3)
+    keep = corners | np.repeat(whole, sizes)
+    kept = np.where(whole, sizes, counts)
+    return np.split(points[keep], np.cumsum(kept)[:-1])
+
+
+def _line_distances(points, start, end):
+    direction = end - start
+    length = np.hypot(direction[0], direction[1])
+    offsets = points - start
+    if length == 0:
+        return np.hypot(offsets[:, 0], offsets[:, 1])
+    return np.abs(direction[0] * offsets[:, 1] - direction[1] * offsets[:, 0]) / length
+
+
+def _douglas_peucker_keep(points, tolerance):
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = True
+    keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        distances = _line_distances(points[start + 1:end].astype(float), points[start], points[end])
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return keep
+
+
+def douglas_peucker(points, tolerance):
+    # A closed ring is split at its first vertex and the vertex farthest from it,
+    # and both halves are simplified as open polylines.
+    points = np.asarray(points)
+    if len(points) <= 3:
+        return points
+    offsets = (points - points[0]).astype(float)
+    farthest = int(np.argmax(np.hypot(offsets[:, 0], offsets[:, 1])))
+    if farthest == 0:
+        return points
+
+    ring = np.concatenate([points, points[:1]])
+    keep = np.zeros(len(ring), dtype=bool)
+    keep[:farthest + 1] |= _douglas_peucker_keep(ring[:farthest + 1], tolerance)
+    keep[farthest:] |= _douglas_peucker_keep(ring[farthest:], tolerance)
+    keep = keep[:-1]
+    if np.count_nonzero(keep) < 3:
+        return points
+    return points[keep]
+
+
+def _triangle_area(a, b, c):
+    return abs((b[0] - a[0]) * (c[1] - a[1]) - (c[0] - a[0]) * (b[1] - a[1])) / 2
+
+
+def visvalingam(points, tolerance):
+    # Repeatedly removes the vertex spanning the smallest triangle with its
+    # neighbors, until every remaining triangle is at least tolerance ** 2 pixels.
+    points = np.asarray(points)
+    n = len(points)
+    if n <= 3:
+        return points
+    threshold = tolerance ** 2
+    coordinates = points.tolist()
+    previous = [(i - 1) % n for i in range(n)]
+    following = [(i + 1) % n for i in range(n)]
+    removed = [False] * n
+    areas = [_triangle_area(coordinates[previous[i]], coordinates[i], coordinates[following[i]]) for i in range(n)]
+    heap = [(area, i) for (i, area) in enumerate(areas)]
+    heapq.heapify(heap)
+
+    remaining = n
+    while heap and remaining > 3:
+        area, i = heapq.heappop(heap)
+        if removed[i] or area != areas[i]:
+            continue
+        if area >= threshold:
+            break
+        removed[i] = True
+        remaining -= 1
+        before = previous[i]
+        after = following[i]
+        following[before] = after
+        previous[after] = before
+        for j in (before, after):
+            areas[j] = _triangle_area(coordinates[previous[j]], coordinates[j], coordinates[following[j]])
+            heapq.heappush(heap, (areas[j], j))
+
+    return points[[not n for n in removed]]
+
+
+def simplify_polygon(points, tolerance=0, method="douglas-peucker"):
+    if method not in simplify_methods:
+        raise ValueError("Unknown simplification method: " + method)
+    points = merge_collinear(points)
+    if tolerance <= 0:
+        return points
+    if method == "douglas-peucker":
+        return douglas_peucker(points, tolerance)
+    return visvalingam(points, tolerance)
+
+
+def simplify_polygons(polygons, tolerance=0, method="douglas-peucker"):
+    if method not in simplify_methods:
+        raise ValueError("Unknown simplification method: " + method)
+    simplified = merge_collinear_rings(polygons)
+    if tolerance > 0:
+        simplify = douglas_peucker if method == "douglas-peucker" else visvalingam
+        simplified = [simplify(n, tolerance) for n in simplified]
+    stats = SimplifyStats(len(polygons), sum(len(n) for n in polygons), sum(len(n) for n in simplified))
+    return simplified, stats
@@ -0,0 +1,52 @@
+import numpy as np
+
+import labeling
+import polygon_image
+
+
+def fill_polygon(canvas, points, color):
+    # Even-odd fill of an axis aligned polygon in graph coordinates (y up),
+    # sampled at pixel centers
+    height, width = canvas.shape
+    points = np.asarray(points)
+    ends = np.roll(points, -1, axis=0)
+    crossings = np.zeros((height, width + 1), dtype=np.uint8)
+    for (x0, y0), (x1, y1) in zip(points.tolist(), ends.tolist()):
+        if x0 == x1 and y0 != y1:
+            top, bottom = sorted((height - y0, height - y1))
+            crossings[top:bottom, x0] ^= 1
+    canvas[np.bitwise_xor.accumulate(crossings, axis=1)[:, :width].astype(bool)] = color
+
+
+def render_groups(canvas, groups):
+    # Draws polygon_image groups onto a packed canvas in order
+    height = canvas.shape[0]
+    for color, kind, shapes in groups:
+        packed = polygon_image.pack_color(color)
+        if kind == "rectangles":
+            for x0, y0, x1, y1 in np.asarray(shapes).tolist():
+                canvas[height - y1:height - y0, x0:x1] = packed
+        else:
+            for points in shapes:
+                fill_polygon(canvas, points, packed)
+    return canvas
+
+
+def render_image(pixels, engine="contours", **options):
+    options = polygon_image._options(dict(options, engine=engine))
+    groups = polygon_image.contour_groups(pixels, options) if engine == "contours" else \
+        polygon_image.rectangle_groups(pixels)
+    canvas = np.zeros(pixels.shape[:2], dtype=np.uint32)
+    return render_groups(canvas, groups)
+
+
+def blocky_image(size, n_colors, block, seed):
+    rng = np.random.default_rng(seed)
+    palette = rng.integers(0, 256, (n_colors, 4), dtype=np.uint8)
+    palette[:, 3] = 255
+    cells = rng.integers(0, n_colors, (size // block + 1, size // block + 1))
+    return palette[np.kron(cells, np.ones((block, block), dtype=int))[:size, :size]]
+
+
+def packed(pixels):
+    return labeling.pack_colors(pixels)
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import contours
+import labeling
+from rendering import blocky_image, render_image
+
+WHITE = (255, 255, 255, 255)
+RED = (255, 0, 0, 255)
+BLUE = (0, 0, 255, 255)
+
+
+def ring_around_crossing():
+    # A red ring closed only by a diagonal touch at its bottom right corner,
+    # around a blue square that leaves through the same corner diagonally
+    pixels = np.full((8, 8, 4), WHITE, dtype=np.uint8)
+    pixels[1:5, 1:5] = RED
+    pixels[4, 4] = WHITE
+    pixels[2:4, 2:4] = BLUE
+    pixels[4, 4:] = BLUE
+    pixels[4:, 7] = BLUE
+    return pixels
+
+
+@pytest.mark.parametrize("diagonals", [False, True])
+def test_ring_closed_by_a_crossing(diagonals):
+    pixels = ring_around_crossing()
+    assert np.array_equal(render_image(pixels, diagonals=diagonals), labeling.pack_colors(pixels))
+
+
+def test_crossing_joins_one_diagonal():
+    pixels = np.array([[RED, BLUE], [BLUE, RED]], dtype=np.uint8)
+    labels = labeling.label_image(pixels, diagonals=True).labels
+    assert labels[0, 0] == labels[1, 1]
+    assert labels[0, 1] != labels[1, 0]
+
+
+@pytest.mark.parametrize("diagonals", [False, True])
+def test_random_images_render_exactly(diagonals):
+    for seed in range(60):
+        pixels = blocky_image(24, 3, 1 + seed % 3, seed)
+        assert np.array_equal(render_image(pixels, diagonals=diagonals), labeling.pack_colors(pixels)), seed
+
+
+def test_holes_follow_the_outer_contour():
+    pixels = np.full((5, 5, 4), WHITE, dtype=np.uint8)
+    pixels[1:4, 1:4] = RED
+    pixels[2, 2] = BLUE
+    traced = contours.trace_contours(labeling.label_image(pixels).labels)
+    white = traced[0]
+    assert len(white) == 2
+    assert white[0].min(axis=0).tolist() == [0, 0] and white[0].max(axis=0).tolist() == [5, 5]
+    assert white[1].min(axis=0).tolist() == [1, 1] and white[1].max(axis=0).tolist() == [4, 4]
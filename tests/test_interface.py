@@ -0,0 +1,265 @@
+import numpy as np
+import pytest
+
+import interface
+
+
+def styled_graph(n, color="\\operatorname{rgb}(10,20,30)"):
+    graph = interface.Graph()
+    graph.reset_expressions()
+    for i in range(n):
+        expression = interface.Expression()
+        expression.set_latex("y=x+" + str(i))
+        expression.set_color_latex(color)
+        graph.append(expression)
+    return graph
+
+
+def style_definitions(graph):
+    return [n._get_fields()["latex"] for n in graph.expressions[0].get_expressions()]
+
+
+def test_intern_styles_never_grows_output():
+    for n in range(2, 30):
+        graph = styled_graph(n)
+        stats = graph.intern_styles()
+        assert stats.bytes_after <= stats.bytes_before
+        assert stats.bytes_after == graph.get_output_size()
+
+
+def test_intern_styles_skips_small_graphs():
+    graph = styled_graph(5)
+    assert graph.intern_styles().variables == 0
+    assert not isinstance(graph.expressions[0], interface.Folder)
+
+
+def test_intern_styles_numbers_on():
+    graph = styled_graph(50)
+    assert graph.intern_styles().variables == 1
+    for expression in styled_graph(50, "\\operatorname{rgb}(200,20,30)").expressions:
+        graph.append(expression)
+    assert graph.intern_styles().variables == 1
+    assert [n.split("=")[0] for n in style_definitions(graph)] == ["c_{1}", "c_{2}"]
+    assert sum(isinstance(n, interface.Folder) for n in graph.expressions) == 1
+
+
+def batch_graph(cache_rows):
+    graph = interface.Graph()
+    graph.reset_expressions()
+    batch = interface.ExpressionBatch(cache_rows)
+    batch.extend(latex=["y=" + str(n) for n in range(10)], color_latex="rgb(1,2,3)")
+    graph.append(batch)
+    return graph, batch
+
+
+def test_batch_rows_are_not_kept_by_default():
+    graph, _ = batch_graph(False)
+    first = graph.get_output_size()
+    interface.reset_cache_stats()
+    assert graph.get_output_size() == first
+    assert interface.get_cache_stats()["misses"] == 10
+
+
+def test_batch_rows_cached_until_changed():
+    graph, batch = batch_graph(True)
+    first = graph.get_output_size()
+    interface.reset_cache_stats()
+    assert graph.get_output_size() == first
+    assert interface.get_cache_stats()["hits"] == 10
+    batch.append(latex="y=10")
+    graph.get_output_size()
+    assert interface.get_cache_stats()["misses"] == 11
+
+
+def test_clear_line_caches():
+    graph = styled_graph(10)
+    graph.get_output_size()
+    graph.clear_line_caches()
+    interface.reset_cache_stats()
+    graph.get_output_size()
+    assert interface.get_cache_stats()["misses"] == 10
+
+
+def test_intern_styles_with_batches():
+    graph, batch = batch_graph(False)
+    batch.extend(latex=["y=x+" + str(n) for n in range(40)], color_latex="rgb(4,5,6)")
+    stats = graph.intern_styles()
+    assert stats.variables == 2
+    assert stats.bytes_after < stats.bytes_before
+
+
+@pytest.mark.parametrize("latex, expected", [
+    ("y=xsin(x)", "y=x\\sin\\left(x\\right)"),
+    ("y=asin(x)", "y=a\\sin\\left(x\\right)"),
+    ("2xcos(x)", "2x\\cos\\left(x\\right)"),
+    ("y=xsinh(x)", "y=x\\sinh\\left(x\\right)"),
+    ("xarcsin(x)", "x\\arcsin\\left(x\\right)"),
+    ("arcsin(x)", "\\arcsin\\left(x\\right)"),
+    ("point(1,2)", "point\\left(1,2\\right)"),
+    ("xsin", "xsin"),
+    ("\\operatorname{max}(1)", "\\operatorname{max}\\left(1\\right)"),
+])
+def test_clean_latex(latex, expected):
+    assert interface.clean_latex(latex) == expected
+
+
+def test_batch_rows_match_setters():
+    values = {"latex": "y=sin(x)", "color_latex": "rgb(1,2,3)", "line_style": "dashed", "line_width": -2,
+              "line_opacity": 1.5, "point_style": "open", "point_size": "a", "point_opacity": 0.25,
+              "fill_opacity": 0.5}
+    expression = interface.Expression()
+    for name, value in values.items():
+        getattr(expression, "set_" + name)(value)
+    batch = interface.ExpressionBatch()
+    batch.append(**values)
+    assert list(batch.iter_strings()) == [expression.to_string()]
+
+
+def expression(expression_id, latex):
+    line = interface.Expression()
+    line.set_id(expression_id)
+    line.set_latex(latex)
+    return line
+
+
+def diffed_graphs():
+    before = interface.Graph()
+    for n in range(4):
+        before.append(expression(str(n), "y=" + str(n)))
+    folder = interface.Folder()
+    folder.set_id("f")
+    folder.set_title("Before")
+    before.append(folder)
+
+    after = interface.Graph()
+    after.append(expression("0", "y=0"))
+    after.append(expression("1", "y=10"))
+    after.append(expression("new", "y=x"))
+    after.append(expression("3", "y=3"))
+    folder = interface.Folder()
+    folder.set_id("f")
+    folder.set_title("After")
+    after.append(folder)
+    return before, after
+
+
+@pytest.fixture(params=["graph", "manifest"])
+def previous(request, tmp_path):
+    before, after = diffed_graphs()
+    if request.param == "graph":
+        return before, after
+    path = tmp_path / "before.json"
+    before.save_manifest(str(path))
+    return str(path), after
+
+
+def test_update_sets_changed_expressions_and_removes_deleted(previous):
+    before, after = previous
+    lines = list(after.iter_update(before))
+    assert lines[0] == "Calc.setExpression({ type: 'expression', id: '1', latex: 'y=10' });"
+    assert lines[1] == "Calc.removeExpression({ id: '2' });"
+    assert not any("'0'" in n or "id: '3'" in n for n in lines)
+
+
+def test_update_patches_added_lines_and_folders_into_the_state(previous):
+    before, after = previous
+    lines = list(after.iter_update(before))
+    patch = lines[lines.index(interface.initial_template):]
+    # The new expression goes right after the one before it, not to the end
+    assert patch[1] == ("expressions.splice(expressions.findIndex(n => n.id === '1') + 1, 0, "
+                        "{ type: 'expression', id: 'new', latex: 'y=x' });")
+    # Calc.setExpression does not take folders
+    assert patch[2] == ("expressions[expressions.findIndex(n => n.id === 'f')] = "
+                        "{ type: 'folder', id: 'f', title: 'After' };")
+    assert patch[3] == interface.end_template
+    assert not any(n.startswith("Calc.setExpression") and "folder" in n for n in lines)
+
+
+def test_unchanged_graph_has_no_update():
+    before, _ = diffed_graphs()
+    assert list(before.iter_update(before.get_manifest())) == []
+
+
+def test_update_needs_ids():
+    graph = interface.Graph()
+    line = interface.Expression()
+    line.set_latex("y=x")
+    graph.append(line)
+    with pytest.raises(ValueError, match="needs an id"):
+        graph.get_manifest()
+    with pytest.raises(ValueError, match="needs an id"):
+        list(graph.iter_update({"version": interface.MANIFEST_VERSION, "expressions": []}))
+
+
+def test_batch_shape_columns_match_setters():
+    square = np.array([[0, 0], [2, 0], [2, 2], [0, 2]])
+    rows = [("polygon", "set_polygon", square), ("polygons", "set_polygons", [square, square + 3]),
+            ("rectangles", "set_rectangles", np.array([[0, 0, 1, 1], [2, 2, 4, 3]]))]
+    for column, setter, shapes in rows:
+        expression = interface.Expression()
+        getattr(expression, setter)(shapes)
+        batch = interface.ExpressionBatch()
+        batch.append(**{column: shapes})
+        assert list(batch.iter_strings()) == [expression.to_string()]
+        assert "\\\\left(" not in expression.to_string()
+
+
+def test_batch_takes_one_latex_column():
+    with pytest.raises(TypeError):
+        interface.ExpressionBatch().append(latex="y=x", polygon=[[0, 0], [1, 0], [1, 1]])
+
+
+def sharded_graph():
+    graph = interface.Graph()
+    graph.reset_expressions()
+    for n in range(6):
+        graph.append(expression("a" + str(n), "y=" + str(n) * 20))
+    folder = interface.Folder()
+    folder.set_id("folder")
+    folder.set_title("Folder")
+    for n in range(4):
+        folder.add_expression(expression("b" + str(n), "y=" + str(n) * 20))
+    graph.append(folder)
+    graph.append(expression("big", "y=" + "9" * 600))
+    for n in range(3):
+        graph.append(expression("c" + str(n), "y=" + str(n) * 20))
+    return graph
+
+
+def pushed_ids(lines):
+    return [n.split("id: '")[1].split("'")[0] for n in lines if n.startswith("expressions.push(")]
+
+
+@pytest.mark.parametrize("max_bytes", [300, 360, 420, 500])
+def test_shards_fit_max_bytes(tmp_path, max_bytes):
+    graph = sharded_graph()
+    manifest = graph.generate_shards(str(tmp_path / "graph.txt"), max_bytes=max_bytes)
+    shards = [(tmp_path / n["file"]).read_text().split("\n") for n in manifest["shards"]]
+    assert [len((tmp_path / n["file"]).read_bytes()) for n in manifest["shards"]] == \
+        [n["bytes"] for n in manifest["shards"]]
+    for shard, entry in zip(shards, manifest["shards"]):
+        if pushed_ids(shard) == ["big"]:
+            # An expression larger than max_bytes gets a shard of its own
+            assert entry["bytes"] > max_bytes
+        else:
+            assert "big" not in pushed_ids(shard)
+            assert entry["bytes"] <= max_bytes
+        assert shard[-1] == interface.end_template
+
+    # Every line is emitted once, in output order
+    assert [n for shard in shards for n in pushed_ids(shard)] == pushed_ids(list(graph.iter_output()))
+    # The folder header travels with its first expression
+    for shard in shards:
+        ids = pushed_ids(shard)
+        if "folder" in ids:
+            assert ids[ids.index("folder") + 1] == "b0"
+
+
+def test_shards_fit_max_expressions():
+    graph = sharded_graph()
+    shards = list(graph.iter_shards(max_expressions=7))
+    assert all(len(pushed_ids(n)) <= 7 for n in shards)
+    assert [n for shard in shards for n in pushed_ids(shard)] == pushed_ids(list(graph.iter_output()))
+    # The folder header would still fit after a5, but is held back for b0
+    assert pushed_ids(shards[0]) == ["a0", "a1", "a2", "a3", "a4", "a5"]
+    assert pushed_ids(shards[1])[:2] == ["folder", "b0"]
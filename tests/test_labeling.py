@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+import labeling
+
+
+def write_pam(path, pixels):
+    height, width, depth = pixels.shape
+    header = "P7\nWIDTH {}\nHEIGHT {}\nDEPTH {}\nMAXVAL 255\nENDHDR\n".format(width, height, depth)
+    path.write_bytes(header.encode() + pixels.tobytes())
+    return path
+
+
+@pytest.mark.parametrize("depth", [1, 2, 3, 4])
+def test_read_pam(tmp_path, depth):
+    pixels = np.random.default_rng(depth).integers(0, 256, (5, 7, depth), dtype=np.uint8)
+    rgba = labeling.unpack_colors(labeling.read_pixels(labeling.open_image(write_pam(tmp_path / "a.pam", pixels))))
+    gray = pixels[..., :1].repeat(3, axis=2)
+    expected = {
+        1: np.concatenate([gray, np.full_like(gray[..., :1], 255)], axis=2),
+        2: np.concatenate([gray, pixels[..., 1:]], axis=2),
+        3: np.concatenate([pixels, np.full_like(gray[..., :1], 255)], axis=2),
+        4: pixels,
+    }[depth]
+    assert np.array_equal(rgba, expected)
+
+
+def test_unsupported_pam_depth(tmp_path):
+    path = write_pam(tmp_path / "a.pam", np.zeros((2, 2, 5), dtype=np.uint8))
+    with pytest.raises(ValueError, match="depth is 5"):
+        labeling.open_netpbm(path)
+
+
+def test_pack_colors_channels():
+    with pytest.raises(ValueError, match="got 6"):
+        labeling.pack_colors(np.zeros((2, 2, 6), dtype=np.uint8))
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+import contours
+import interface
+import labeling
+import layering
+import polygon_image
+from rendering import blocky_image, packed, render_image
+
+WHITE = (255, 255, 255, 255)
+RED = (255, 0, 0, 255)
+BLUE = (0, 0, 255, 255)
+
+
+def nested_rings():
+    # White around a red ring around a blue ring around a red dot, next to a
+    # blue square that encloses nothing
+    pixels = np.full((9, 12, 4), WHITE, dtype=np.uint8)
+    pixels[1:8, 1:8] = RED
+    pixels[2:7, 2:7] = BLUE
+    pixels[3:6, 3:6] = WHITE
+    pixels[4, 4] = RED
+    pixels[2:5, 9:11] = BLUE
+    return pixels
+
+
+def test_enclosing_labels():
+    pixels = nested_rings()
+    labels = labeling.label_image(pixels).labels
+    parents = layering.enclosing_labels(labels, contours.trace_contours(labels))
+    assert parents[labels[0, 0]] == -1
+    assert parents[labels[1, 1]] == labels[0, 0]
+    assert parents[labels[2, 2]] == labels[1, 1]
+    assert parents[labels[3, 3]] == labels[2, 2]
+    assert parents[labels[4, 4]] == labels[3, 3]
+    assert parents[labels[2, 9]] == labels[0, 0]
+
+
+def test_containment_layers():
+    # White, red ring, blue ring, white, red dot
+    parents = [-1, 0, 1, 2, 3, 0]
+    colors = [0, 1, 2, 0, 1, 2]
+    assert layering.containment_layers(parents, colors).tolist() == [0, 1, 2, 3, 4, 1]
+    # A patch in a hole of one of its own color shares its layer
+    assert layering.containment_layers([-1, 0, 1], [0, 1, 1]).tolist() == [0, 1, 1]
+
+
+@pytest.mark.parametrize("diagonals", [False, True])
+def test_grouped_images_render_exactly(diagonals):
+    assert np.array_equal(render_image(nested_rings(), diagonals=diagonals, group_colors=True),
+                          packed(nested_rings()))
+    for seed in range(20):
+        pixels = blocky_image(48, 3, 1 + seed % 3, seed)
+        assert np.array_equal(render_image(pixels, diagonals=diagonals, group_colors=True), packed(pixels))
+
+
+def test_group_by_layer_splits_long_groups():
+    items = list(range(7))
+    groups = layering.group_by_layer(items, [0] * 6 + [1], np.zeros(7, dtype=np.int64), max_length=3)
+    assert groups == [(0, [0, 1, 2]), (0, [3, 4, 5]), (1, [6])]
+
+
+def test_grouped_expressions_fit_in_lists():
+    # A checkerboard gives every pixel its own patch, all in the first layer
+    pixels = np.zeros((150, 150, 4), dtype=np.uint8)
+    pixels[..., 3] = 255
+    pixels[(np.indices((150, 150)).sum(axis=0) % 2) == 1, :3] = 255
+    groups = polygon_image.contour_groups(pixels, polygon_image._options({"group_colors": True}))
+    assert max(len(polygons) for (_, _, polygons) in groups) <= interface.MAX_LIST_LENGTH
+    assert sum(len(polygons) for (_, _, polygons) in groups) == 150 * 150
+    assert len(groups) == 4
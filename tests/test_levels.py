@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+import labeling
+import levels
+import polygon_image
+from rendering import blocky_image, render_groups
+
+
+def smooth_image(height, width, seed=0):
+    # Blobs of a few colors with uneven edges, so every level differs from the next
+    rng = np.random.default_rng(seed)
+    palette = rng.integers(0, 256, (6, 4), dtype=np.uint8)
+    palette[:, 3] = 255
+    ys, xs = np.mgrid[0:height, 0:width]
+    field = np.sin(xs / 7.0 + rng.random() * 6) + np.cos(ys / 5.0 + rng.random() * 6) + rng.random((height, width)) * 0.4
+    return palette[np.digitize(field, np.linspace(-2, 2.4, 5))]
+
+
+def level_composites(pixels, engine, **options):
+    # Yields (factor, canvas after drawing this level, expected image) per level
+    options = polygon_image._options(dict(options, engine=engine))
+    height, width = pixels.shape[:2]
+    source = labeling.pack_colors(pixels)
+    canvas = np.zeros((height, width), dtype=np.uint32)
+    factors = levels.level_factors(options["levels"], options["level_ratio"])
+    for number, (factor, residual, skip) in enumerate(levels.residual_levels(source, factors, options["diagonals"])):
+        level_pixels = labeling.unpack_colors(residual)
+        groups = polygon_image.contour_groups(level_pixels, options) if engine == "contours" else \
+            polygon_image.rectangle_groups(level_pixels)
+        groups = polygon_image.level_groups(groups, int(skip) if number else None,
+                                            (factor, residual.shape[0], width, height))
+        render_groups(canvas, groups)
+        yield factor, canvas, levels.upsample(levels.downsample(source, factor), factor, height, width)
+
+
+@pytest.mark.parametrize("engine", ["contours", "rectangles"])
+@pytest.mark.parametrize("level_count, ratio", [(3, 2), (3, 4), (2, 3)])
+def test_levels_composite_to_source(engine, level_count, ratio):
+    for pixels in [smooth_image(61, 83), blocky_image(64, 5, 3, seed=4)]:
+        for factor, canvas, expected in level_composites(pixels, engine, levels=level_count, level_ratio=ratio):
+            assert np.array_equal(canvas, expected), factor
+        assert np.array_equal(canvas, labeling.pack_colors(pixels))
+
+
+@pytest.mark.parametrize("engine", ["contours", "rectangles"])
+def test_unchanged_pixels_are_not_drawn(engine):
+    pixels = np.zeros((16, 16, 4), dtype=np.uint8)
+    pixels[..., 3] = 255
+    pixels[5, 7] = (255, 0, 0, 255)
+    reports = polygon_image.report_levels(pixels, levels=2, level_ratio=4, engine=engine)
+    assert reports[0].expressions == 1
+    assert reports[1].pixels == 1
+    assert reports[1].expressions == 1
+
+
+def test_rectangle_levels_never_draw_the_skip_color():
+    pixels = smooth_image(40, 40, seed=3)
+    graph = polygon_image.image_to_graph(pixels, levels=3, level_ratio=2, engine="rectangles")
+    assert "rgb\\\\left(0, 0, 0\\\\right)" not in "".join(graph.iter_output())
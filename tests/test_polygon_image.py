@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import interface
+import labeling
+import polygon_image
+
+
+def test_output_paths_keep_the_input_directory():
+    assert polygon_image.output_paths_for(["x/a.png", "y/a.png"]) == [os.path.join("x", "a.txt"),
+                                                                     os.path.join("y", "a.txt")]
+
+
+@pytest.mark.parametrize("images", [["a.png", "a.ppm"], ["x/a.png", "y/a.png"], ["a.png", "./a.png"]])
+def test_output_collisions_are_refused(images):
+    with pytest.raises(ValueError):
+        polygon_image.output_paths_for(images, "out")
+
+
+def smooth_image(size):
+    y, x = np.mgrid[0:size, 0:size]
+    channels = [(np.sin(x / 17) + np.cos(y / 23) + 2) * 60, (np.sin((x + y) / 29) + 1) * 120,
+                (np.cos(x * y / 5000) + 1) * 120, np.full(x.shape, 255.0)]
+    return np.stack(channels, axis=-1).astype(np.uint8)
+
+
+def graph_expressions(graph):
+    return sum(len(n.get_expressions()) for n in graph.expressions if isinstance(n, interface.Folder))
+
+
+@pytest.mark.parametrize("options", [{}, {"group_colors": True}, {"engine": "rectangles"},
+                                     {"levels": 2, "group_colors": True}])
+def test_max_expressions_counts_emitted_expressions(options):
+    pixels = smooth_image(120)
+    graph = polygon_image.image_to_graph(pixels, max_expressions=40, **options)
+    assert graph_expressions(graph) <= 40
+    colors = len(np.unique(labeling.pack_colors(polygon_image.prepare_pixels(
+        pixels, polygon_image._options(dict(options, max_expressions=40))))))
+    ungrouped = len(np.unique(labeling.pack_colors(polygon_image.prepare_pixels(
+        pixels, polygon_image._options({"max_expressions": 40})))))
+    assert colors >= ungrouped
+
+
+def test_verbose_reports_from_the_command_line(tmp_path, capsys):
+    arguments = vars(polygon_image.parse_arguments(["a.png", "-v"]))
+    assert arguments["verbose"]
+    image = str(tmp_path / "a.png")
+    Image.fromarray(smooth_image(40)).save(image)
+    polygon_image.convert_file(image, str(tmp_path / "a.txt"), verbose=True, engine="auto")
+    printed = capsys.readouterr().out
+    assert printed.startswith(image + ":")
+    assert "Vertices:" in printed
+    assert "Engine:" in printed
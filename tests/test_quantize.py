@@ -0,0 +1,25 @@
+import numpy as np
+
+import labeling
+import quantize
+from rendering import blocky_image
+
+
+def test_median_cut_returns_n_colors():
+    rng = np.random.default_rng(0)
+    colors = rng.integers(0, 256, (2000, 4)).astype(np.float64)
+    counts = rng.integers(1, 10, 2000)
+    assert quantize.median_cut(colors, counts, 32).shape == (32, 4)
+    assert quantize.median_cut(colors, counts, 5000).shape == (2000, 4)
+
+
+def test_median_cut_weights_the_mean_by_count():
+    colors = np.array([[0, 0, 0, 255], [10, 0, 0, 255]], dtype=np.float64)
+    palette = quantize.median_cut(colors, np.array([3, 1]), 1)
+    assert np.allclose(palette, [[2.5, 0, 0, 255]])
+
+
+def test_max_expressions_is_respected():
+    pixels = blocky_image(64, 12, 4, seed=2)
+    result = quantize.quantize(pixels, max_expressions=40)
+    assert len(labeling.label_image(result).areas) <= 40
@@ -0,0 +1,75 @@
+import http.client
+import io
+import threading
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import render_server
+
+
+@pytest.fixture(scope="module")
+def server():
+    dispatcher = render_server.Dispatcher(workers=1, max_pending=2, timeout=60)
+    server = render_server.make_server(dispatcher, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    dispatcher.shutdown()
+
+
+def post(server, path, body):
+    connection = http.client.HTTPConnection(*server.server_address[:2])
+    connection.request("POST", path, body)
+    response = connection.getresponse()
+    return response.status, response.read()
+
+
+def test_convert_streams_script(server):
+    pixels = np.zeros((8, 8, 4), dtype=np.uint8)
+    pixels[..., 3] = 255
+    pixels[2:6, 2:6, 0] = 255
+    image = io.BytesIO()
+    Image.fromarray(pixels).save(image, "PNG")
+    status, body = post(server, "/convert", image.getvalue())
+    assert status == 200
+    assert body.startswith(b"let state = Calc.getState();")
+    assert body.rstrip().endswith(b"Calc.setState(state);")
+
+
+def test_body_that_is_not_an_image(server):
+    status, body = post(server, "/convert", b"not an image")
+    assert status == 400
+    assert b"not a readable image" in body
+
+
+def test_timed_out_job_keeps_its_slot():
+    dispatcher = render_server.Dispatcher(workers=1, max_pending=1, timeout=0.2)
+    try:
+        with pytest.raises(render_server.TimeoutError):
+            dispatcher.run(time.sleep, 1)
+        # The sleep still runs on the only worker
+        with pytest.raises(render_server.Overloaded):
+            dispatcher.run(time.sleep, 0)
+        assert dispatcher.stats()["queue_depth"] == 1
+        time.sleep(1.5)
+        assert dispatcher.stats()["queue_depth"] == 0
+        assert dispatcher.run(abs, -1) == 1
+    finally:
+        dispatcher.shutdown()
+
+
+def test_timed_out_result_is_discarded():
+    discarded = []
+    dispatcher = render_server.Dispatcher(workers=1, max_pending=1, timeout=0.2)
+    try:
+        with pytest.raises(render_server.TimeoutError):
+            dispatcher.run(time.sleep, 0.5, discard=discarded.append)
+        time.sleep(1)
+        assert discarded == [None]
+    finally:
+        dispatcher.shutdown()
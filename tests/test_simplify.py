@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+import contours
+import labeling
+import simplify
+from rendering import blocky_image
+
+
+def traced_rings(seed):
+    labels = labeling.label_image(blocky_image(80, 4, 1 + seed % 3, seed)).labels
+    return [ring for patch in contours.trace_contours(labels) for ring in patch]
+
+
+def test_merge_collinear_rings_matches_each_ring():
+    rings = traced_rings(0) + [np.array([[0, 0], [1, 0], [2, 0]]), np.array([[0, 0], [1, 0], [2, 0], [3, 0]]),
+                               np.array([[0, 0], [2, 0], [2, 2]])]
+    merged = simplify.merge_collinear_rings(rings)
+    assert len(merged) == len(rings)
+    for ring, result in zip(rings, merged):
+        assert np.array_equal(result, simplify.merge_collinear(ring))
+
+
+@pytest.mark.parametrize("method", simplify.simplify_methods)
+@pytest.mark.parametrize("tolerance", [0, 1.5])
+def test_simplify_polygons_matches_each_polygon(method, tolerance):
+    rings = traced_rings(1)
+    simplified, stats = simplify.simplify_polygons(rings, tolerance, method)
+    for ring, result in zip(rings, simplified):
+        assert np.array_equal(result, simplify.simplify_polygon(ring, tolerance, method))
+    assert stats.vertices_after == sum(len(n) for n in simplified)
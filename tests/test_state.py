@@ -0,0 +1,53 @@
+import io
+import json
+
+import interface
+
+
+def sample_state():
+    return {
+        "version": interface.STATE_VERSION,
+        "expressions": {"list": [
+            {"type": "folder", "id": "f", "title": "Sliders", "collapsed": True, "memo": "kept"},
+            {"type": "expression", "id": "1", "folderId": "f", "latex": "a=2", "color": "#c74440",
+             "slider": {"hardMin": True, "min": "0", "max": "10"}, "description": "speed", "lineStyle": "DASHED"},
+            {"type": "text", "id": "2", "text": "notes", "secret": True},
+            {"type": "table", "id": "3", "columns": [{"latex": "x_1", "values": ["1", "2"], "color": "#2d70b3"}],
+             "regression": None, "custom": [1, 2]},
+            {"type": "image", "id": "4", "image_url": "data:", "width": "10"},
+        ]},
+    }
+
+
+def test_state_round_trip_keeps_every_field():
+    state = sample_state()
+    graph = interface.Graph.from_state(json.dumps(state))
+    expected = [{k: v for (k, v) in n.items() if v is not None} for n in state["expressions"]["list"]]
+    assert graph.get_state()["expressions"]["list"] == expected
+
+
+def test_loaded_graph_writes_the_same_script_twice():
+    graph = interface.Graph.from_state(sample_state())
+    first = io.StringIO()
+    graph.generate_output(first)
+    reloaded = interface.Graph.from_state(graph.get_state())
+    second = io.StringIO()
+    reloaded.generate_output(second)
+    assert first.getvalue() == second.getvalue()
+    assert "description: 'speed'" in first.getvalue()
+
+
+def test_setters_keep_unknown_fields():
+    graph = interface.Graph.from_state(sample_state())
+    expression = graph.expressions[0].get_expressions()[0]
+    expression.set_latex("a=3")
+    state = expression.to_state()
+    assert state["latex"] == "a=3"
+    assert state["color"] == "#c74440"
+    assert state["slider"]["max"] == "10"
+
+
+def test_lazy_folders_load_the_same_expressions():
+    eager = interface.Graph.from_state(sample_state())
+    lazy = interface.Graph.from_state(json.dumps(sample_state()), lazy=True, chunk_size=7)
+    assert lazy.get_state() == eager.get_state()
@@ -0,0 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+import labeling
+import tiling
+from rendering import blocky_image, render_image
+
+
+@pytest.fixture(scope="module")
+def executor():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        yield executor
+
+
+@pytest.mark.parametrize("diagonals", [False, True])
+@pytest.mark.parametrize("seed", range(6))
+def test_bands_match_single_path(executor, diagonals, seed):
+    pixels = blocky_image(300, 3, 1 + seed % 3, seed)
+    single_result, single_contours = tiling.label_and_trace(pixels, diagonals)
+    band_result, band_contours = tiling.label_and_trace(pixels, diagonals, 4, executor)
+    assert np.array_equal(single_result.labels, band_result.labels)
+    assert np.array_equal(single_result.colors, band_result.colors)
+    assert len(single_contours) == len(band_contours)
+    for single, band in zip(single_contours, band_contours):
+        assert len(single) == len(band)
+        assert all(np.array_equal(a, b) for (a, b) in zip(single, band))
+
+
+@pytest.mark.parametrize("diagonals", [False, True])
+def test_bands_render_exactly(diagonals):
+    # A component spanning every seam, the background, traced in one window
+    pixels = blocky_image(120, 2, 2, 7)
+    pixels[:, :4] = pixels[0, 0]
+    assert np.array_equal(render_image(pixels, diagonals=diagonals, tiles=3), labeling.pack_colors(pixels))
@@ -0,0 +1,141 @@
+import numpy as np
+
+import contours
+import labeling
+import profiling
+
+
+# Bands thinner than this cost more in process overhead than they save
+MIN_BAND_HEIGHT = 64
+
+
+def split_bands(height, tiles):
+    # Full width bands keep the raster order of every band equal to the image's,
+    # so stitched labels and traced contours match the single band path exactly
+    tiles = max(1, min(tiles, height // MIN_BAND_HEIGHT))
+    bounds = np.linspace(0, height, tiles + 1).astype(int).tolist()
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _label_band(packed, diagonals):
+    return labeling.label_image(packed, diagonals)
+
+
+def _trace_band(labels, top, selected, diagonals, left=0):
+    traced = contours.trace_label_contours(labels, diagonals, selected)
+    for patch in traced.values():
+        for n in range(len(patch)):
+            patch[n] = patch[n] + (left, top)
+    return traced
+
+
+def _seam_edges(upper_labels, lower_labels, upper_colors, lower_colors, diagonals):
+    a = [upper_labels]
+    b = [lower_labels]
+    same = [upper_colors == lower_colors]
+    if diagonals:
+        a += [upper_labels[:-1], upper_labels[1:]]
+        b += [lower_labels[1:], lower_labels[:-1]]
+        # The top right to bottom left pair loses a crossing, as in labeling._run_edges
+        same += [upper_colors[:-1] == lower_colors[1:],
+                 (upper_colors[1:] == lower_colors[:-1]) & (upper_colors[:-1] != lower_colors[1:])]
+    a = np.concatenate(a)
+    b = np.concatenate(b)
+    same = np.concatenate(same)
+    return a[same], b[same]
+
+
+def stitch_bands(packed, bands, band_results, diagonals=False):
+    offsets = np.cumsum([0] + [len(n.areas) for n in band_results])
+    a = []
+    b = []
+    for n in range(1, len(bands)):
+        seam = bands[n][0]
+        upper, lower = _seam_edges(band_results[n - 1].labels[-1] + offsets[n - 1],
+                                   band_results[n].labels[0] + offsets[n],
+                                   packed[seam - 1], packed[seam], diagonals)
+        a.append(upper)
+        b.append(lower)
+
+    # Local labels are in raster order and offsets grow band by band, so every
+    # root is the component's raster first label, as in the single band path
+    roots = labeling.connected_roots(offsets[-1], np.concatenate(a or [[]]).astype(np.int64),
+                                     np.concatenate(b or [[]]).astype(np.int64))
+    _, global_labels = np.unique(roots, return_inverse=True)
+    count = global_labels.max() + 1 if len(global_labels) else 0
+
+    labels = np.concatenate([global_labels[n.labels + offsets[i]] for i, n in enumerate(band_results)])
+
+    colors = np.zeros(count, dtype=np.uint32)
+    colors[global_labels] = np.concatenate([n.colors for n in band_results])
+
+    local_bboxes = np.concatenate([n.bboxes + (0, top, 0, top) for n, (top, _) in zip(band_results, bands)])
+    bboxes = np.empty((count, 4), dtype=np.int64)
+    bboxes[:, :2] = np.iinfo(np.int64).max
+    bboxes[:, 2:] = 0
+    np.minimum.at(bboxes[:, 0], global_labels, local_bboxes[:, 0])
+    np.minimum.at(bboxes[:, 1], global_labels, local_bboxes[:, 1])
+    np.maximum.at(bboxes[:, 2], global_labels, local_bboxes[:, 2])
+    np.maximum.at(bboxes[:, 3], global_labels, local_bboxes[:, 3])
+
+    areas = np.bincount(global_labels, weights=np.concatenate([n.areas for n in band_results]),
+                        minlength=count).astype(np.int64)
+
+    return labeling.LabelResult(labels, colors, bboxes, areas)
+
+
+def label_and_trace(image, diagonals=False, tiles=1, executor=None):
+    # Labels and traces the image band by band on the executor, components that
+    # cross a seam are merged by a union-find over the seam pixels and traced on
+    # the whole label map afterwards
+    packed = labeling.pack_colors(labeling.image_to_array(image))
+    bands = split_bands(packed.shape[0], tiles)
+    if len(bands) == 1 or executor is None:
+        with profiling.stage("patch finding"):
+            label_result = labeling.label_image(packed, diagonals)
+        with profiling.stage("boundary tracing"):
+            return label_result, contours.trace_contours(label_result.labels, diagonals)
+
+    with profiling.stage("patch finding"):
+        band_results = list(executor.map(_label_band, [packed[top:bottom] for (top, bottom) in bands],
+                                         [diagonals] * len(bands)))
+        label_result = stitch_bands(packed, bands, band_results, diagonals)
+    labels = label_result.labels
+
+    with profiling.stage("boundary tracing"):
+        return label_result, _trace_bands(labels, label_result, bands, diagonals, executor)
+
+
+def _trace_bands(labels, label_result, bands, diagonals, executor):
+    height = labels.shape[0]
+
+    # A band traces the components that lie inside it, with one halo row on each
+    # side so the cracks along its seams are seen
+    futures = []
+    inside = np.zeros(len(label_result.areas), dtype=bool)
+    for top, bottom in bands:
+        selected = np.flatnonzero((label_result.bboxes[:, 1] >= top) & (label_result.bboxes[:, 3] <= bottom))
+        inside[selected] = True
+        halo_top = max(top - 1, 0)
+        futures.append(executor.submit(_trace_band, labels[halo_top:min(bottom + 1, height)], halo_top,
+                                       selected, diagonals))
+
+    # Components that cross a seam are traced on the pool as well, grouped by
+    # the first seam they cross, each group in the window its boxes span
+    crossing = np.flatnonzero(~inside)
+    seams = np.array([top for (top, _) in bands[1:]])
+    first_seams = np.searchsorted(seams, label_result.bboxes[crossing, 1], side="right")
+    for seam in np.unique(first_seams).tolist():
+        selected = crossing[first_seams == seam]
+        bboxes = label_result.bboxes[selected]
+        left = max(int(bboxes[:, 0].min()) - 1, 0)
+        top = max(int(bboxes[:, 1].min()) - 1, 0)
+        right = int(bboxes[:, 2].max()) + 1
+        bottom = int(bboxes[:, 3].max()) + 1
+        futures.append(executor.submit(_trace_band, labels[top:bottom, left:right], top, selected, diagonals, left))
+
+    traced = {}
+    for future in futures:
+        traced.update(future.result())
+
+    return [traced[n] for n in range(len(label_result.areas))]